@@ -0,0 +1,118 @@
+"""
+Index of the register files in a directory, built with a single os.scandir
+pass: the NVR_REGISTER_TXT_<district>_<constituency>_<sub county>_<parish>_
+<polling station>_<sequence> components of every name are parsed once and
+drive merge grouping and the district names of the merged files.
+"""
+import csv
+import json
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# Example: NVR_REGISTER_TXT_76_004_01_01_01_123.pdf, also found inside stage
+# file names such as final_transformed_NVR_REGISTER_TXT_76_004_01_01_01_123.xlsx
+REGISTER_NAME_PATTERN = re.compile(
+    r'NVR_REGISTER_TXT_(?P<district>[^_.]+)'
+    r'(?:_(?P<constituency>[^_.]+))?'
+    r'(?:_(?P<sub_county>[^_.]+))?'
+    r'(?:_(?P<parish>[^_.]+))?'
+    r'(?:_(?P<polling_station>[^_.]+))?'
+    r'(?:_(?P<sequence>[^_.]+))?'
+)
+
+
+class RegisterFile(NamedTuple):
+    """One register file and the components of its name (None if absent)."""
+    name: str
+    path: str
+    district: str
+    constituency: Optional[str]
+    sub_county: Optional[str]
+    parish: Optional[str]
+    polling_station: Optional[str]
+    sequence: Optional[str]
+
+
+def parse_register_name(name: str, directory: str = "") -> Optional[RegisterFile]:
+    """RegisterFile for a file name, None if it has no NVR_REGISTER_TXT_<district> part."""
+    match = REGISTER_NAME_PATTERN.search(name)
+    if not match:
+        return None
+    return RegisterFile(name, os.path.join(directory, name), **match.groupdict())
+
+
+def scan_registers(directory: str, suffix: Optional[str] = None) -> List[RegisterFile]:
+    """
+    The register files in directory (only those ending in suffix, if given),
+    sorted by name, from one os.scandir pass. Files whose names don't follow
+    the register naming are logged and left out.
+    """
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if suffix and not entry.name.lower().endswith(suffix):
+                continue
+            if not entry.is_file():
+                continue
+            register = parse_register_name(entry.name, directory)
+            if register is None:
+                logging.warning(f"Filename does not match expected format: {entry.name}")
+                continue
+            files.append(register)
+    files.sort(key=lambda f: f.name)
+    return files
+
+
+def group_by_district(files: Iterable[RegisterFile]) -> Dict[str, List[RegisterFile]]:
+    """District identifier -> its register files, in the order given."""
+    groups = {}
+    for register in files:
+        groups.setdefault(register.district, []).append(register)
+    return groups
+
+
+def unique_districts(id_map: Dict[str, str]) -> Dict[str, str]:
+    """
+    id_map without the identifiers whose district name another identifier
+    also maps to (compared case-insensitively, like the exported table
+    names), so their merged files keep their merged_<identifier> names
+    instead of overwriting each other. Each clash is logged.
+    """
+    identifiers = {}
+    for identifier, district in id_map.items():
+        if district:
+            identifiers.setdefault(district.lower(), []).append(identifier)
+    clashing = set()
+    for district, members in identifiers.items():
+        if len(members) > 1:
+            logging.error(f"District '{id_map[members[0]]}' is mapped from identifiers {members}; "
+                          f"their merged files keep their merged_<identifier> names")
+            clashing.update(members)
+    return {identifier: district for identifier, district in id_map.items() if identifier not in clashing}
+
+
+def load_district_map(path: str) -> Dict[str, str]:
+    """
+    Identifier -> district name, from a JSON object ({"76": "OYAM", ...}) or
+    a CSV file with 'identifier' and 'district' columns. Identifiers sharing
+    a district name are left out (see unique_districts).
+    """
+    if path.lower().endswith(".json"):
+        with open(path) as f:
+            id_map = {str(k).strip(): str(v).strip() for k, v in json.load(f).items()}
+    else:
+        with open(path, newline="") as f:
+            id_map = {row["identifier"].strip(): row["district"].strip() for row in csv.DictReader(f)}
+    return unique_districts(id_map)
+
+
+def district_filename(identifier: str, id_map: Optional[Dict[str, str]] = None, ext: str = ".xlsx") -> str:
+    """
+    File name of a merged district: <district><ext> if id_map names it,
+    merged_<identifier><ext> otherwise. id_map must not map two identifiers
+    to the same district (see unique_districts).
+    """
+    district = (id_map or {}).get(identifier)
+    return f"{district}{ext}" if district else f"merged_{identifier}{ext}"
@@ -1,100 +1,357 @@
 import pandas as pd
 from pathlib import Path
 import re
+from instrumentation import file_size, track
+from manifest import changed_files, open_manifest, record
+from table_io import READ_CHUNK_ROWS, read_table_chunks, stage_suffix, write_table_stream
 
+MIN_FIELDS = 7  # perno + Name + dob + sex + appid_receipt_no + address_parts
+# date_pattern = re.compile(r'\b\d{2}-\d{2}-\d{4}\b')
+DATE_PATTERN = re.compile(
+    r'\b(\d{2}[-\/]\d{2}[-\/]\d{4})\b')  # Enhanced pattern
 
-def apply_final_transformations(input_dir="transformed", output_dir="final"):
+# Whole-record pattern over a row's space-joined tokens, equivalent to the
+# token scan in parse_record: the date is the first date-like token and must
+# be preceded by the voter id and at least one name token, and followed by
+# gender, registration id and at least one address token.
+_DATE_TOKEN = r'\d{2}[-/]\d{2}[-/]\d{4}\b'
+RECORD_PATTERN = re.compile(
+    r'^(?P<perno>\S+)'
+    rf' (?P<surname>(?!{_DATE_TOKEN})\S+)'
+    rf'(?P<othernames>(?: (?!{_DATE_TOKEN})\S+)*)'
+    rf' (?P<dob>{_DATE_TOKEN}\S*)'
+    r' (?P<sex>\S+)'
+    r' (?P<appid_receipt_no>\S+)'
+    r' (?P<village>.+)$'
+)
+# Voter ids are ASCII digits; at most 18 of them, so every id fits in Int64
+VOTER_ID_PATTERN = re.compile(r'[0-9]{1,18}')
+RECORD_COLUMNS = ['perno', 'surname', 'othernames', 'dob', 'sex', 'appid_receipt_no', 'village']
+
+# Record schema applied at parse time and restored when records are read
+# back from a stage file: nullable integer voter ids, real dates of birth,
+# categoricals for the few distinct genders and villages and Arrow-backed
+# strings for the names and registration ids.
+RECORD_DTYPES = {
+    'perno': 'Int64',
+    'surname': 'string[pyarrow]',
+    'othernames': 'string[pyarrow]',
+    'dob': 'datetime64[s]',
+    'sex': pd.CategoricalDtype(['F', 'M']),
+    'appid_receipt_no': 'string[pyarrow]',
+    'village': 'category',
+}
+DOB_FORMAT = '%d-%m-%Y'
+
+
+def voter_ids(col):
+    """
+    Voter ids as Int64. Ids that don't match VOTER_ID_PATTERN (or, for a
+    numeric column, aren't whole numbers of at most 18 digits) become missing.
+    """
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        valid = (col % 1 == 0) & (col.abs() < 10 ** 18)
+        return col.where(valid.fillna(False).astype(bool)).astype('Int64')
+    text = col.astype('string').str.strip()
+    valid = text.str.fullmatch(VOTER_ID_PATTERN.pattern).fillna(False).astype(bool)
+    return pd.to_numeric(text.where(valid), errors='coerce').astype('Int64')
+
+
+def typed_records(df):
+    """
+    Apply RECORD_DTYPES to a frame of voter records (any other columns are
+    kept as they are). A frame without all of RECORD_COLUMNS is returned
+    unchanged. Dates of birth are parsed from the DD-MM-YYYY text of the
+    register; a date that doesn't exist becomes NaT and an invalid voter id
+    (see voter_ids) becomes missing.
+    """
+    if not set(RECORD_COLUMNS).issubset(df.columns):
+        return df
+    df = df.copy()
+    for name, dtype in RECORD_DTYPES.items():
+        col = df[name]
+        if name == 'perno':
+            col = voter_ids(col)
+            invalid = int((col.isna() & df[name].notna()).sum())
+            if invalid:
+                print(f"{invalid} voter ids are not valid ids, stored as missing")
+        elif name == 'dob' and not pd.api.types.is_datetime64_any_dtype(col):
+            col = pd.to_datetime(col.astype('string').str.slice(0, 10), format=DOB_FORMAT, errors='coerce')
+            invalid = int((col.isna() & df[name].notna()).sum())
+            if invalid:
+                print(f"{invalid} dates of birth are not valid dates, stored as missing")
+        df[name] = col.astype(dtype)
+    return df
+
+
+def row_text(row):
+    """Join the non-empty cells of one row into a single string."""
+    return ' '.join([
+        c.strftime('%d-%m-%Y') if isinstance(c, pd.Timestamp)
+        else str(c).strip().replace('/', '-')
+        for c in row if pd.notna(c)
+    ])
+
+
+def parse_record(raw_text):
+    """
+    Parse one row's text into a voter record dict.
+    Raises ValueError describing why the row is not a valid record.
+    """
+    # Split into components while preserving multi-word fields
+    tokens = raw_text.split()
+    if len(tokens) < MIN_FIELDS:
+        raise ValueError(
+            f"Only {len(tokens)} components found (minimum {MIN_FIELDS} required)")
+
+    # Find date position with priority scanning
+    date_index = next((i for i, t in enumerate(
+        tokens) if DATE_PATTERN.match(t)), None)
+
+    # Validate critical components
+    if not date_index or date_index < 2:
+        raise ValueError(
+            f"Date not found in expected position. Tokens: {tokens[:6]}")
+    if len(tokens) < date_index + 4:
+        raise ValueError(
+            f"Missing components after date. Found: {tokens[date_index:]}")
+
+    # Extract components with dynamic positioning
+    components = {
+        'voter_id': tokens[0],
+        'name_parts': tokens[1:date_index],
+        'dob': tokens[date_index],
+        'gender': tokens[date_index+1],
+        'reg_id': tokens[date_index+2],
+        'address_parts': tokens[date_index+3:]
+    }
+
+    # Validation checks
+    if not VOTER_ID_PATTERN.fullmatch(components['voter_id']):
+        raise ValueError(
+            f"Invalid Voter ID format: {components['voter_id']}")
+    if components['gender'].upper() not in {'M', 'F'}:
+        raise ValueError(
+            f"Invalid gender: {components['gender']}")
+    if not components['address_parts']:
+        raise ValueError("Missing address information")
+
+    return {
+        'perno': components['voter_id'],
+        'surname': components['name_parts'][0] if components['name_parts'] else '',
+        'othernames': ' '.join(components['name_parts'][1:]) if len(components['name_parts']) > 1 else '',
+        'dob': components['dob'],
+        'sex': components['gender'].upper(),
+        'appid_receipt_no': components['reg_id'],
+        'village': ' '.join(components['address_parts'])
+    }
+
+
+def _column_text(col):
+    """Cell text of one column as in row_text, '' for missing cells (stripping and '/' are left to row_texts)."""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        text = col.dt.strftime('%d-%m-%Y')
+    else:
+        text = col.astype(str)
+        if col.dtype == object:
+            is_timestamp = col.map(type) == pd.Timestamp
+            if is_timestamp.any():
+                text[is_timestamp] = col[is_timestamp].map(lambda c: c.strftime('%d-%m-%Y'))
+    return text.where(col.notna(), '')
+
+
+def row_texts(df):
+    """
+    Vectorized row_text over a whole frame, with runs of whitespace
+    collapsed so the result is the row's tokens joined by single spaces.
+    """
+    parts = [_column_text(col).astype(object) for _, col in df.items()]
+    if not parts:
+        return pd.Series('', index=df.index, dtype=object)
+    joined = parts[0].str.cat(parts[1:], sep=' ') if len(parts) > 1 else parts[0]
+    joined = joined.str.replace('/', '-', regex=False)
+    return joined.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def parse_rows(texts):
+    """
+    Parse many rows' texts at once with RECORD_PATTERN.
+
+    Parameters:
+    texts (Series): Normalised row texts, as produced by row_texts
+
+    Returns:
+    tuple: (records DataFrame, boolean Series marking the accepted rows)
+    """
+    fields = texts.str.extract(RECORD_PATTERN)
+    n_tokens = texts.str.count(' ').where(texts != '', -1) + 1
+    valid = (
+        fields['perno'].notna()
+        & (n_tokens >= MIN_FIELDS)
+        & fields['perno'].str.fullmatch(VOTER_ID_PATTERN.pattern).fillna(False).astype(bool)
+        & fields['sex'].str.upper().isin(['M', 'F'])
+    )
+    records = fields[valid].copy()
+    records['othernames'] = records['othernames'].str.lstrip(' ')
+    records['sex'] = records['sex'].str.upper()
+    return records[RECORD_COLUMNS].reset_index(drop=True), valid
+
+
+def rejection_reason(raw_text):
+    """Reason parse_record gives for rejecting a row ('' if it parses)."""
+    try:
+        parse_record(raw_text)
+    except Exception as e:
+        return str(e)
+    return ''
+
+
+def parse_records(df, error_log=None, source_file=''):
+    """
+    Parse voter records out of a transformed register.
+
+    Parameters:
+    df (DataFrame): Transformed data with positional columns (header row
+        excluded); the first two columns are serial/index columns
+    error_log (list): If given, a DataFrame of the rejected rows (source_file,
+        row_index, raw_text, reason) is appended to it
+    source_file (str): File name recorded with the rejected rows
+
+    Returns:
+    DataFrame: One row per valid voter record, typed with RECORD_DTYPES
+    """
+    df = df.dropna(how='all').drop(columns=[0, 1])
+    texts = row_texts(df)
+    records, valid = parse_rows(texts)
+
+    if error_log is not None and not valid.all():
+        # Rejected rows are rare, so their reason comes from the row-wise parser
+        rejected = texts[~valid]
+        error_log.append(pd.DataFrame({
+            'source_file': source_file,
+            'row_index': rejected.index,
+            'raw_text': rejected.values,
+            'reason': rejected.map(rejection_reason).values,
+        }))
+
+    return typed_records(records)
+
+
+def save_rejected_rows(error_log, rejected_path, replaced_sources=None):
+    """
+    Write the collected rejected rows in one go, as Parquet if rejected_path
+    ends in .parquet and as CSV otherwise. Returns the number of new rows.
+
+    With replaced_sources (the source files an incremental run processed
+    again), the rows already in rejected_path are kept except those of
+    replaced_sources, which the new rows replace, so the rejected rows of
+    files skipped as unchanged stay on record. Otherwise rejected_path is
+    overwritten.
+    """
+    parquet = str(rejected_path).lower().endswith('.parquet')
+    frames = list(error_log)
+    if replaced_sources is not None and Path(rejected_path).exists():
+        if parquet:
+            previous = pd.read_parquet(rejected_path)
+        else:
+            previous = pd.read_csv(rejected_path, dtype=str, keep_default_na=False).astype({'row_index': 'int64'})
+        kept = previous[~previous['source_file'].isin(set(replaced_sources))]
+        if not frames and len(kept) == len(previous):
+            return 0
+        frames.insert(0, kept)
+    if not frames:
+        return 0
+    rejected = pd.concat(frames, ignore_index=True)
+    Path(rejected_path).parent.mkdir(parents=True, exist_ok=True)
+    if parquet:
+        rejected.to_parquet(rejected_path, index=False)
+    else:
+        rejected.to_csv(rejected_path, index=False)
+    return sum(len(f) for f in error_log)
+
+
+def parse_chunks(chunks, error_log=None, source_file='', totals=None):
+    """
+    parse_records over a transformed register read in chunks (see
+    table_io.read_table_chunks), yielding each chunk's records. The chunks'
+    index continues across chunks, so rejected rows keep their row_index in
+    the file. totals (dict), if given, receives 'rows_in' (rows read) and
+    'rows' (non-empty rows). Yields an empty records frame for an empty file.
+    """
+    totals = {} if totals is None else totals
+    totals.update(rows_in=0, rows=0)
+    parsed = False
+    for df in chunks:
+        # parse_records addresses the columns by position
+        df = df.set_axis(range(df.shape[1]), axis=1)
+        totals['rows_in'] += len(df)
+        totals['rows'] += len(df.dropna(how='all'))
+        parsed = True
+        yield parse_records(df, error_log, source_file)
+    if not parsed:
+        yield typed_records(pd.DataFrame(columns=RECORD_COLUMNS))
+
+
+def apply_final_transformations(input_dir="transformed", output_dir="final",
+                                rejected_path="rejected/rejected_rows.csv", state_db=None,
+                                file_format=None, chunk_rows=READ_CHUNK_ROWS):
     """
     Process single-sheet Excel files for final transformations
 
     Parameters:
     input_dir (str): Source directory with transformed files
     output_dir (str): Target directory for final output
-    """
-    # Configuration
-    # date_pattern = re.compile(r'\b\d{2}-\d{2}-\d{4}\b')
-    min_fields = 7  # perno + Name + dob + sex + appid_receipt_no + address_parts
-    date_pattern = re.compile(
-        r'\b(\d{2}[-\/]\d{2}[-\/]\d{4})\b')  # Enhanced pattern
+    rejected_path (str): CSV or .parquet file receiving every rejected row
+        with its source file, row index, raw text and reason (None to skip)
+    state_db (str): SQLite manifest (see manifest.py); if given, files whose
+        content is unchanged since they were last processed are skipped, and
+        the rows rejected from this run's files replace their earlier rows in
+        rejected_path while those of the skipped files are kept
+    file_format (str): Format of the transformed and final files, one of
+        table_io.FORMAT_SUFFIXES (default table_io.INTERMEDIATE_FORMAT)
+    chunk_rows (int): Rows read, parsed and written at a time, which bounds
+        the memory a file takes
 
+    Returns:
+    dict: File name -> {'accepted': n, 'rejected': n}
+    """
     Path(output_dir).mkdir(parents=True, exist_ok=True)
+    error_log = [] if rejected_path else None
+    counts = {}
+    excel_files = sorted(Path(input_dir).glob(f"*{stage_suffix(file_format)}"))
+    manifest = open_manifest(state_db) if state_db else None
+    if manifest:
+        hashes = changed_files(manifest, "final", input_dir, [f.name for f in excel_files])
+        excel_files = [f for f in excel_files if f.name in hashes]
 
-    for excel_file in Path(input_dir).glob("*.xlsx"):
-        processed_data = []
-        # error_log = []
+    processed = []
+    for excel_file in excel_files:
+        processed.append(excel_file.name)
         output_path = Path(output_dir) / f"final_{excel_file.name}"
         try:
-            # df = pd.read_excel(excel_file, header=None,
-            #                    engine='openpyxl').drop(columns=[0, 1])
-            df = pd.read_excel(excel_file, header=None, skiprows=1,
-                               engine='openpyxl').dropna(how='all').drop(columns=[0, 1])
-
-            for idx, row in df.iterrows():
-                raw_text = ''
-                try:
-                    # Extract and clean all text from row
-                    raw_text = ' '.join([
-                        c.strftime('%d-%m-%Y') if isinstance(c, pd.Timestamp)
-                        else str(c).strip().replace('/', '-')
-                        for c in row if pd.notna(c)
-                    ])
-
-                    # Split into components while preserving multi-word fields
-                    tokens = raw_text.split()
-                    if len(tokens) < min_fields:
-                        raise ValueError(
-                            f"Only {len(tokens)} components found (minimum {min_fields} required)")
-
-                    # Find date position with priority scanning
-                    date_index = next((i for i, t in enumerate(
-                        tokens) if date_pattern.match(t)), None)
-
-                    # Validate critical components
-                    if not date_index or date_index < 2:
-                        raise ValueError(
-                            f"Date not found in expected position. Tokens: {tokens[:6]}")
-                    if len(tokens) < date_index + 4:
-                        raise ValueError(
-                            f"Missing components after date. Found: {tokens[date_index:]}")
-
-                    # Extract components with dynamic positioning
-                    components = {
-                        'voter_id': tokens[0],
-                        'name_parts': tokens[1:date_index],
-                        'dob': tokens[date_index],
-                        'gender': tokens[date_index+1],
-                        'reg_id': tokens[date_index+2],
-                        'address_parts': tokens[date_index+3:]
-                    }
-
-                    # Validation checks
-                    if not components['voter_id'].isdigit():
-                        raise ValueError(
-                            f"Invalid Voter ID format: {components['voter_id']}")
-                    if components['gender'].upper() not in {'M', 'F'}:
-                        raise ValueError(
-                            f"Invalid gender: {components['gender']}")
-                    if not components['address_parts']:
-                        raise ValueError("Missing address information")
-
-                    processed_data.append({
-                        'perno': components['voter_id'],
-                        'surname': components['name_parts'][0] if components['name_parts'] else '',
-                        'othernames': ' '.join(components['name_parts'][1:]) if len(components['name_parts']) > 1 else '',
-                        'dob': components['dob'],
-                        'sex': components['gender'].upper(),
-                        'appid_receipt_no': components['reg_id'],
-                        'village': ' '.join(components['address_parts'])
-                    })
-
-                except Exception as e:
-                    print(f"Critical system error processing excel: {str(e)}")
-
-            # Save outputs
-            pd.DataFrame(processed_data).to_excel(output_path, index=False)
-            # if error_log:
-            #     pd.DataFrame(error_log).to_csv(output_path, index=False)
+            with track("final", excel_file.name) as metrics:
+                metrics["bytes_in"] = file_size(excel_file)
+                totals = {}
+                chunks = read_table_chunks(excel_file, file_format, chunk_rows)
+                written = write_table_stream(
+                    parse_chunks(chunks, error_log, excel_file.name, totals), output_path, file_format)
+                metrics.update(rows_in=totals['rows_in'], rows_out=written, bytes_out=file_size(output_path))
+
+            rejected = totals['rows'] - written
+            counts[excel_file.name] = {'accepted': written, 'rejected': rejected}
+            print(f"{excel_file.name}: {written} accepted, {rejected} rejected")
+            if manifest:
+                record(manifest, "final", excel_file.name, hashes[excel_file.name], output_path)
 
         except Exception as e:
             print(f"Critical system error reading excel: {str(e)}")
-            return False
+            counts = False
+            break
+
+    if error_log is not None:
+        written = save_rejected_rows(error_log, rejected_path, processed if manifest else None)
+        if written:
+            print(f"Wrote {written} rejected rows to {rejected_path}")
+    if manifest:
+        manifest.close()
+    return counts
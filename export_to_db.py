@@ -1,15 +1,250 @@
+import hashlib
+import io
 import os
+import time
 import logging
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
+from consolidate import typed_records
+from instrumentation import file_size, record_file
+from manifest import changed_files, open_manifest, record
+from table_io import READ_CHUNK_ROWS, read_excel_chunks
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+# Rows serialised into the in-memory CSV buffer per COPY round-trip
+COPY_CHUNK_ROWS = 100_000
+
+# pandas inferred type -> PostgreSQL column type (anything else is TEXT)
+POSTGRES_TYPES = {
+    "integer": "BIGINT",
+    "floating": "DOUBLE PRECISION",
+    "mixed-integer-float": "DOUBLE PRECISION",
+    "decimal": "NUMERIC",
+    "boolean": "BOOLEAN",
+    "datetime64": "TIMESTAMP",
+    "datetime": "TIMESTAMP",
+    "date": "DATE",
+}
+
+
+def _quote(identifier):
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def postgres_type(col):
+    """PostgreSQL column type for a DataFrame column."""
+    if isinstance(col.dtype, pd.DatetimeTZDtype):
+        return "TIMESTAMPTZ"
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.astype(col.cat.categories.dtype)
+    return POSTGRES_TYPES.get(pd.api.types.infer_dtype(col, skipna=True), "TEXT")
+
+
+def create_table_sql(df, schema, table_name):
+    """CREATE TABLE statement with explicit column types for df."""
+    columns = ",\n    ".join(f"{_quote(name)} {postgres_type(col)}" for name, col in df.items())
+    return f"CREATE TABLE {_quote(schema)}.{_quote(table_name)} (\n    {columns}\n)"
+
+
+def copy_dataframe(conn, df, schema, table_name, if_exists="replace", chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Load df into schema.table_name with COPY FROM STDIN, streaming the rows
+    through an in-memory CSV buffer chunk_rows at a time. Runs on the given
+    SQLAlchemy connection, so it is part of the caller's transaction.
+    """
+    target = f"{_quote(schema)}.{_quote(table_name)}"
+    exists = conn.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {"name": target}).scalar()
+    if exists and if_exists == "fail":
+        raise ValueError(f"Table {target} already exists.")
+    if exists and if_exists == "replace":
+        conn.exec_driver_sql(f"DROP TABLE {target}")
+    if not exists or if_exists == "replace":
+        conn.exec_driver_sql(create_table_sql(df, schema, table_name))
+
+    columns = ", ".join(_quote(c) for c in df.columns)
+    copy_sql = f"COPY {target} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    cursor = conn.connection.cursor()
+    try:
+        for start in range(0, len(df), chunk_rows):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunk_rows].to_csv(buffer, index=False, header=False, na_rep="\\N")
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+    finally:
+        cursor.close()
+
+
+def _staging_name(table_name):
+    # PostgreSQL truncates identifiers to 63 bytes; the hash of the full name
+    # keeps tables sharing a long prefix from sharing a staging table
+    digest = hashlib.blake2b(table_name.encode(), digest_size=4).hexdigest()
+    return f"{table_name[:44]}_{digest}__staging"
+
+
+def _conform_frame(conn, df, types, schema, table_name):
+    """
+    Fit a later frame of a table to the column types its first frame
+    created (types: column -> PostgreSQL type, updated here). Whole numbers
+    arriving as floats (a missing value in an integer column) are loaded as
+    integers; any other column whose values no longer fit its type is
+    widened to TEXT in the caller's transaction.
+    """
+    for name, col in df.items():
+        expected, actual = types.get(name), postgres_type(col)
+        if expected in (None, "TEXT", actual) or not col.notna().any():
+            continue
+        if expected == "BIGINT" and actual == "DOUBLE PRECISION" and (col.dropna() % 1 == 0).all():
+            df[name] = col.astype("Int64")
+            continue
+        logging.warning(f"Column {name} of {schema}.{table_name} changes from {expected} to {actual} "
+                        f"between chunks, loading it as TEXT")
+        conn.exec_driver_sql(f"ALTER TABLE {_quote(schema)}.{_quote(table_name)} "
+                             f"ALTER COLUMN {_quote(name)} TYPE TEXT USING {_quote(name)}::text")
+        types[name] = "TEXT"
+    return df
+
+
+def load_frames(engine, frames, schema, table_name, if_exists="replace", loader="to_sql", atomic_swap=False):
+    """
+    Load a table arriving as a sequence of frames with the same columns into
+    schema.table_name in a single transaction: the first frame creates (or
+    replaces) the table and the others are appended, so only one frame is
+    held in memory at a time. Nothing is loaded if there are no frames.
+    Column types come from the first frame; a later frame whose values no
+    longer fit a column's type widens it (see _conform_frame).
+
+    With atomic_swap (and if_exists="replace") the rows go into a staging
+    table first, which then replaces the target by DROP + RENAME in the same
+    transaction: readers keep seeing the old table until the commit and
+    never see a dropped or partially loaded one.
+
+    Returns:
+    int: Rows loaded
+    """
+    replace_via_staging = atomic_swap and if_exists == "replace"
+    target = _staging_name(table_name) if replace_via_staging else table_name
+    mode = "replace" if replace_via_staging else if_exists
+
+    n_rows, types = 0, None
+    with engine.begin() as conn:
+        for i, df in enumerate(frames):
+            frame_mode = mode if i == 0 else "append"
+            # The first frame's columns type the table; later ones must fit
+            if types is None:
+                types = {name: postgres_type(col) for name, col in df.items()}
+            else:
+                df = _conform_frame(conn, df, types, schema, target)
+            if loader == "copy":
+                copy_dataframe(conn, df, schema, target, frame_mode)
+            else:
+                df.to_sql(
+                    target,
+                    con=conn,
+                    schema=schema,
+                    if_exists=frame_mode,
+                    index=False,
+                    method="multi",
+                )
+            n_rows += len(df)
+        if replace_via_staging and n_rows:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {_quote(schema)}.{_quote(table_name)}")
+            conn.exec_driver_sql(
+                f"ALTER TABLE {_quote(schema)}.{_quote(target)} RENAME TO {_quote(table_name)}")
+    return n_rows
+
+
+def export_chunks(file_path, imported, chunk_rows=READ_CHUNK_ROWS):
+    """
+    The rows of an Excel file (all of its sheets) chunk_rows at a time, as
+    export_excel_file loads them: cleaned column names, voter records typed
+    and 'serialno' and 'date_imported' (imported) columns added.
+    """
+    loaded = 0
+    for df in read_excel_chunks(file_path, chunk_rows):
+        # Clean columns: lowercase and underscores instead of spaces
+        df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
+
+        # Voter records keep their schema (see consolidate.RECORD_DTYPES), with
+        # the dates of birth as dates so both loaders create a DATE column
+        df = typed_records(df)
+        if pd.api.types.is_datetime64_dtype(df.get("dob")):
+            df["dob"] = df["dob"].dt.date
+
+        # Add serialno (continuing across chunks) and date_imported columns
+        df["serialno"] = range(loaded + 1, loaded + len(df) + 1)
+        df["date_imported"] = imported
+        loaded += len(df)
+        yield df
+
+
+def export_excel_file(engine, file_path, schema="pdf_to_excel_data", if_exists="replace",
+                      loader="to_sql", atomic_swap=False, chunk_rows=READ_CHUNK_ROWS):
+    """
+    Export one Excel file (all of its sheets) to schema.<file name, lowercased>,
+    reading and loading it chunk_rows rows at a time.
+
+    Returns:
+    dict: table, rows, seconds and rows_per_sec (rows is 0 for an empty file)
+    """
+    fname = os.path.basename(file_path)
+    table_name = os.path.splitext(fname)[0].lower()
+    start = time.perf_counter()
+    imported = datetime.now()
+
+    rows = load_frames(engine, export_chunks(file_path, imported, chunk_rows), schema, table_name,
+                       if_exists, loader, atomic_swap)
+    if not rows:
+        logging.warning(f"{fname} is empty, skipping.")
+        return {"table": table_name, "rows": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+
+    seconds = time.perf_counter() - start
+    logging.info(f"Exported {fname} to {schema}.{table_name}: {rows} rows in {seconds:.1f}s "
+                 f"({rows / seconds:.0f} rows/s)")
+    return {"table": table_name, "rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds}
+
+
+def create_export_engine(POSTGRES_HOST=None, POSTGRES_PORT=None, POSTGRES_DB=None, POSTGRES_USER=None,
+                         POSTGRES_PASSWORD=None, schema="pdf_to_excel_data", pool_size=1):
+    """
+    SQLAlchemy engine for the export database (connection settings default to
+    the POSTGRES_* environment variables, see export_excels_to_postgres),
+    with pool_size pooled connections and `schema` created if missing.
+    """
+    # Load configuration from env if not provided
+    POSTGRES_HOST = POSTGRES_HOST or os.getenv("POSTGRES_HOST", "localhost")
+    POSTGRES_PORT_env = POSTGRES_PORT or os.getenv("POSTGRES_PORT", "5432")
+    try:
+        POSTGRES_PORT = int(POSTGRES_PORT_env)
+    except (TypeError, ValueError):
+        logging.warning(f"Invalid POSTGRES_PORT '{POSTGRES_PORT_env}', defaulting to 5432")
+        POSTGRES_PORT = 5432
+    POSTGRES_DB = POSTGRES_DB or os.getenv("POSTGRES_DB")
+    POSTGRES_USER = POSTGRES_USER or os.getenv("POSTGRES_USER")
+    POSTGRES_PASSWORD = POSTGRES_PASSWORD or os.getenv("POSTGRES_PASSWORD")
+
+    # Build DB connection string
+    db_url = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+    try:
+        # One pooled connection per concurrent load
+        engine = create_engine(db_url, future=True, pool_size=max(1, pool_size), max_overflow=0)
+        with engine.connect() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+            conn.commit()
+    except SQLAlchemyError as e:
+        logging.error(f"Error connecting to DB or creating schema: {e}")
+        raise
+
+    return engine
+
 
 def export_excels_to_postgres(
     folder_path,
@@ -19,7 +254,12 @@ def export_excels_to_postgres(
     POSTGRES_USER=None,
     POSTGRES_PASSWORD=None,
     schema="pdf_to_excel_data",
-    if_exists="replace"
+    if_exists="replace",
+    loader="to_sql",
+    workers=1,
+    atomic_swap=False,
+    state_db=None,
+    chunk_rows=READ_CHUNK_ROWS
 ):
     """
     Export all Excel files in `folder_path` to PostgreSQL tables within the given schema.
@@ -34,59 +274,82 @@ def export_excels_to_postgres(
         POSTGRES_PASSWORD (str): Database password. Defaults to env POSTGRES_PASSWORD or 'airflow'.
         schema (str): PostgreSQL schema to write tables into. Default "pdf_to_excel_data".
         if_exists (str): Behavior when table exists - "replace" (default), "append", or "fail".
+        loader (str): "to_sql" (multi-row INSERTs) or "copy" (COPY FROM STDIN via psycopg2,
+            with explicitly typed CREATE TABLE).
+        workers (int): Number of files loaded concurrently, each on its own pooled connection.
+        atomic_swap (bool): Load replaced tables into a staging table and swap it in
+            within the same transaction (see load_frames).
+        state_db (str): SQLite manifest (see manifest.py); if given, only files whose
+            content changed since their last successful export are loaded.
+        chunk_rows (int): Rows read and loaded at a time per file, which bounds the
+            memory each concurrent load takes.
+
+    Returns:
+        list: Per-table dicts with table, rows, seconds and rows_per_sec (plus error on failure).
     """
+    if loader not in ("to_sql", "copy"):
+        raise ValueError(f"Unknown loader '{loader}', expected 'to_sql' or 'copy'")
 
-    # Load configuration from env if not provided
-    POSTGRES_HOST = POSTGRES_HOST or os.getenv("POSTGRES_HOST", "localhost")
-    POSTGRES_PORT_env = POSTGRES_PORT or os.getenv("POSTGRES_PORT", "5432")
-    try:
-        POSTGRES_PORT = int(POSTGRES_PORT_env)
-    except (TypeError, ValueError):
-        logging.warning(f"Invalid POSTGRES_PORT '{POSTGRES_PORT_env}', defaulting to 5432")
-        POSTGRES_PORT = 5432
-    POSTGRES_DB = POSTGRES_DB or os.getenv("POSTGRES_DB")
-    POSTGRES_USER = POSTGRES_USER or os.getenv("POSTGRES_USER")
-    POSTGRES_PASSWORD = POSTGRES_PASSWORD or os.getenv("POSTGRES_PASSWORD")
+    workers = max(1, workers)
+    engine = create_export_engine(POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD,
+                                  schema, pool_size=workers)
 
-    # Build DB connection string
-    db_url = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    if not state_db:
+        return export_files(engine, folder_path, schema, if_exists, loader, workers, atomic_swap,
+                            chunk_rows=chunk_rows)
 
+    manifest = open_manifest(state_db)
     try:
-        engine = create_engine(db_url, future=True)
-        with engine.connect() as conn:
-            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
-            conn.commit()
-    except SQLAlchemyError as e:
-        logging.error(f"Error connecting to DB or creating schema: {e}")
-        raise
+        fnames = [f for f in sorted(os.listdir(folder_path)) if f.lower().endswith(".xlsx")]
+        hashes = changed_files(manifest, "export", folder_path, fnames, check_output=False)
+        logging.info(f"{len(fnames) - len(hashes)} of {len(fnames)} files unchanged since their last export")
+        if not hashes:
+            return []
+        results = export_files(engine, folder_path, schema, if_exists, loader, workers, atomic_swap,
+                               fnames=list(hashes), chunk_rows=chunk_rows)
+        for fname, result in zip(hashes, results):
+            if "error" not in result:
+                record(manifest, "export", fname, hashes[fname], f"{schema}.{result['table']}")
+        return results
+    finally:
+        manifest.close()
 
-    # Process each Excel file
-    for fname in os.listdir(folder_path):
-        if fname.lower().endswith(".xlsx"):
-            table_name = os.path.splitext(fname)[0].lower()
-            file_path = os.path.join(folder_path, fname)
-            try:
-                df = pd.read_excel(file_path, engine="openpyxl")
-                if df.empty:
-                    logging.warning(f"{fname} is empty, skipping.")
-                    continue
-
-                # Clean columns: lowercase and underscores instead of spaces
-                df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
-
-                # Add serialno and date_imported columns
-                df["serialno"] = range(1, len(df) + 1)
-                df["date_imported"] = datetime.now()
-
-                # with engine.begin() as conn:
-                df.to_sql(
-                    table_name,
-                    con=engine,
-                    schema=schema,
-                    if_exists=if_exists,
-                    index=False,
-                    method="multi",
-                )
-                logging.info(f"Exported {fname} to {schema}.{table_name}")
-            except Exception as e:
-                logging.error(f"Failed to export {fname}: {e}")
+
+def export_files(engine, folder_path, schema="pdf_to_excel_data", if_exists="replace", loader="to_sql",
+                 workers=1, atomic_swap=False, fnames=None, chunk_rows=READ_CHUNK_ROWS):
+    """
+    Export the .xlsx files in folder_path (or just `fnames`) with up to
+    `workers` concurrent loads and log a per-table summary.
+    """
+    fnames = [f for f in (fnames or sorted(os.listdir(folder_path))) if f.lower().endswith(".xlsx")]
+
+    def export(fname):
+        try:
+            return export_excel_file(engine, os.path.join(folder_path, fname), schema,
+                                     if_exists, loader, atomic_swap, chunk_rows)
+        except Exception as e:
+            logging.error(f"Failed to export {fname}: {e}")
+            return {"table": os.path.splitext(fname)[0].lower(), "rows": 0, "seconds": 0.0,
+                    "rows_per_sec": 0.0, "error": str(e)}
+
+    start = time.perf_counter()
+    if workers <= 1:
+        results = [export(fname) for fname in fnames]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(export, fnames))
+    elapsed = time.perf_counter() - start
+
+    for fname, r in zip(fnames, results):
+        record_file("export", fname, status="failed" if "error" in r else "ok", wall_seconds=r["seconds"],
+                    rows_out=r["rows"], bytes_in=file_size(os.path.join(folder_path, fname)))
+
+    total = sum(r["rows"] for r in results)
+    failed = sum("error" in r for r in results)
+    for r in results:
+        status = f"FAILED ({r['error']})" if "error" in r else f"{r['rows_per_sec']:.0f} rows/s"
+        logging.info(f"{schema}.{r['table']}: {r['rows']} rows, {r['seconds']:.1f}s, {status}")
+    if results:
+        logging.info(f"Exported {total} rows to {len(results) - failed}/{len(results)} tables in "
+                     f"{elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s overall)")
+    return results
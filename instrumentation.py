@@ -0,0 +1,195 @@
+import cProfile
+import csv
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+# Columns of the CSV run report, one row per stage and per file
+REPORT_FIELDS = [
+    "level", "stage", "item", "status", "wall_seconds", "cpu_seconds", "peak_rss_mb",
+    "children_peak_rss_mb", "rows_in", "rows_out", "bytes_in", "bytes_out", "rows_per_sec",
+]
+
+_lock = threading.Lock()
+_run = {"started": None, "stages": [], "files": []}
+# Process peak RSS (KiB) before the last high-water mark reset, and the
+# number of track() blocks currently open
+_peak = {"kb": 0, "open": 0}
+
+
+def reset_run() -> None:
+    """Start a new run report, dropping everything recorded so far."""
+    with _lock:
+        _run.update(started=datetime.now().isoformat(timespec="seconds"), stages=[], files=[])
+
+
+def file_size(path) -> int:
+    """Size of a file in bytes (0 if it doesn't exist)."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def files_size(paths: Iterable) -> int:
+    return sum(file_size(p) for p in paths)
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in KiB on Linux; resetting the high-water mark lowers it,
+    # so the peak seen before the last reset is kept for the process
+    peak = resource.getrusage(who).ru_maxrss
+    if who == resource.RUSAGE_SELF:
+        peak = max(peak, _peak["kb"])
+    return peak / 1024
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the peak RSS of this process to its current RSS (Linux only), so
+    ru_maxrss measures what comes next. Returns False if it can't be reset.
+    """
+    _peak["kb"] = max(_peak["kb"], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _cpu_seconds(who=resource.RUSAGE_SELF) -> float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _with_rate(entry: Dict) -> Dict:
+    rows = entry.get("rows_out") or entry.get("rows_in")
+    wall = entry.get("wall_seconds")
+    entry["rows_per_sec"] = round(rows / wall, 1) if rows and wall else None
+    return entry
+
+
+def record_file(stage: str, item: str, **metrics) -> Dict:
+    """
+    Record metrics (wall_seconds, cpu_seconds, rows_in, rows_out, bytes_in,
+    bytes_out, status, ...) of one file of a stage, e.g. for work done in a
+    worker process where track() can't be used.
+    """
+    entry = _with_rate({"level": "file", "stage": stage, "item": str(item), "status": "ok", **metrics})
+    with _lock:
+        _run["files"].append(entry)
+    return entry
+
+
+@contextmanager
+def track(stage: str, item: str):
+    """
+    Measure one file of a stage. Yields a dict the caller fills with
+    rows_in, rows_out, bytes_in, bytes_out (and status); wall time, CPU
+    time and peak RSS of this process while the file was processed are
+    added on exit. Where the peak can't be reset (no /proc, or another
+    file is tracked at the same time by a different thread), the RSS
+    peak covers everything since the last reset instead.
+    """
+    metrics = {"status": "ok"}
+    with _lock:
+        if not _peak["open"]:
+            _reset_peak_rss()
+        _peak["open"] += 1
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield metrics
+    except Exception:
+        metrics["status"] = "failed"
+        raise
+    finally:
+        with _lock:
+            _peak["open"] -= 1
+        record_file(stage, item, wall_seconds=round(time.perf_counter() - wall, 4),
+                    cpu_seconds=round(time.process_time() - cpu, 4),
+                    peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), **metrics)
+
+
+@contextmanager
+def stage(name: str, profile_dir: Optional[str] = None):
+    """
+    Measure a whole stage: wall time, CPU time of this process and of the
+    worker processes it waited for, peak RSS of both, and the totals of
+    the files recorded for the stage. With profile_dir, the stage also
+    runs under cProfile and the stats are dumped to <profile_dir>/<name>.prof.
+    """
+    with _lock:
+        first_file = len(_run["files"])
+    wall, cpu, children_cpu = time.perf_counter(), _cpu_seconds(), _cpu_seconds(resource.RUSAGE_CHILDREN)
+    profiler = cProfile.Profile() if profile_dir else None
+    status = "ok"
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    except Exception:
+        status = "failed"
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_path = os.path.join(profile_dir, f"{name}.prof")
+            profiler.dump_stats(profile_path)
+            logging.info(f"Wrote cProfile stats of stage '{name}' to {profile_path}")
+        with _lock:
+            files = [f for f in _run["files"][first_file:] if f["stage"] == name]
+        entry = {
+            "level": "stage", "stage": name, "item": "", "status": status,
+            "wall_seconds": round(time.perf_counter() - wall, 4),
+            "cpu_seconds": round(_cpu_seconds() - cpu + _cpu_seconds(resource.RUSAGE_CHILDREN) - children_cpu, 4),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "children_peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        }
+        for key in ("rows_in", "rows_out", "bytes_in", "bytes_out"):
+            values = [f[key] for f in files if f.get(key) is not None]
+            entry[key] = sum(values) if values else None
+        with _lock:
+            _run["stages"].append(_with_rate(entry))
+
+
+def run_report() -> Dict:
+    """The current run report: start time, stage totals and per-file records."""
+    with _lock:
+        return {"started": _run["started"], "stages": list(_run["stages"]), "files": list(_run["files"])}
+
+
+def write_report(path: str) -> str:
+    """
+    Write the run report as JSON or, for a .csv path, as one row per stage
+    and per file (see REPORT_FIELDS). Returns the path.
+    """
+    report = run_report()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(report["stages"] + report["files"])
+    else:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    return path
+
+
+def format_stages() -> str:
+    """Stage totals of the current run as a plain text table."""
+    lines = [f"{'STAGE':<10} {'WALL s':>9} {'CPU s':>9} {'RSS MB':>8} {'ROWS OUT':>10} {'ROWS/s':>10}"]
+    for s in run_report()["stages"]:
+        lines.append(f"{s['stage']:<10} {s['wall_seconds']:>9.2f} {s['cpu_seconds']:>9.2f} "
+                     f"{max(s['peak_rss_mb'], s['children_peak_rss_mb']):>8.0f} "
+                     f"{s['rows_out'] if s['rows_out'] is not None else '-':>10} "
+                     f"{s['rows_per_sec'] if s['rows_per_sec'] is not None else '-':>10}")
+    return "\n".join(lines)
@@ -2,8 +2,11 @@ from merge import merge_excels
 from consolidate import apply_final_transformations
 from transform import transform_excels
 from pdftoexcel import convert_pdfs
-from rename import rename_merged_files
-from export_to_db import export_excels_to_postgres
+from catalog import load_district_map
+from export_to_db import create_export_engine, export_excels_to_postgres
+from pipeline import run_in_memory, run_overlapped
+from instrumentation import format_stages, reset_run, stage, write_report
+from datetime import datetime
 import os
 import sys
 
@@ -18,38 +21,109 @@ identifier_to_district = {
     # ...etc
 }
 
-RENAME_SUFFIX = '.xlsx'
-# Set to True to overwrite if exists
-OVERWRITE = False
+# Optional JSON ({"76": "OYAM", ...}) or CSV (identifier,district) file
+# replacing identifier_to_district, see catalog.load_district_map
+DISTRICT_MAP_FILE = None
 FINAL_DIR = "merged"
+# Worker processes and per-file timeout (seconds) for PDF conversion
+CONVERT_WORKERS = os.cpu_count() or 1
+CONVERT_TIMEOUT = 900
+# PDFs handed to each worker's JVM at a time
+CONVERT_BATCH_SIZE = 4
+# PDFs longer than this many pages are split into page ranges converted concurrently
+CONVERT_SHARD_PAGES = 100
+# Table extraction backend: "tabula" (Java) or "pdfplumber" (pure Python)
+CONVERT_EXTRACTOR = "tabula"
+# "files": every stage writes/reads its own directory of stage files
+#          (.xlsx, .parquet or .arrow, see table_io.INTERMEDIATE_FORMAT)
+# "memory": convert -> merge pass DataFrames directly between stages
+# "overlapped": like "memory", but each district is merged and
+#               exported as soon as all of its PDFs are done, while the
+#               workers carry on with the other PDFs
+PIPELINE_MODE = "files"
+# Directory for the optional intermediate spreadsheets in "memory" and "overlapped" modes
+DEBUG_DIR = None
+# DB loader: "to_sql" (multi-row INSERTs) or "copy" (COPY FROM STDIN)
+EXPORT_LOADER = "copy"
+# District files loaded concurrently, each swapped in atomically from a staging table
+EXPORT_WORKERS = 4
+EXPORT_ATOMIC_SWAP = True
+# SQLite manifest of content hashes per stage: only new or changed PDFs flow
+# through, and only the merge groups they belong to are rebuilt and
+# re-exported. None reprocesses everything.
+STATE_DB = "pipeline_state.sqlite"
+# Run reports (wall/CPU time, peak RSS, rows and bytes per stage and file)
+# are written here as run_<timestamp>.json and .csv
+REPORT_DIR = "reports"
+# Stages run under cProfile, with the stats dumped to REPORT_DIR, e.g. ["transform"]
+PROFILE_STAGES = []
 
 
-def run_pdf_to_excel_converter():
+def _stage(name):
+    return stage(name, profile_dir=REPORT_DIR if name in PROFILE_STAGES else None)
+
+
+def run_pdf_to_excel_converter(mode=PIPELINE_MODE):
+    reset_run()
+    # Merged files are written under their district names directly
+    id_map = load_district_map(DISTRICT_MAP_FILE) if DISTRICT_MAP_FILE else identifier_to_district
+    try:
+        if mode == "overlapped":
+            print("====================Starting overlapped convert/transform/merge/export====================")
+            with _stage("overlapped"):
+                run_overlapped(output_dir=FINAL_DIR, extractor=CONVERT_EXTRACTOR, workers=CONVERT_WORKERS,
+                               timeout=CONVERT_TIMEOUT, batch_size=CONVERT_BATCH_SIZE, debug_dir=DEBUG_DIR,
+                               state_db=STATE_DB, id_map=id_map,
+                               engine=create_export_engine(pool_size=EXPORT_WORKERS), loader=EXPORT_LOADER,
+                               atomic_swap=EXPORT_ATOMIC_SWAP, export_workers=EXPORT_WORKERS)
+            print("====================Done overlapped convert/transform/merge/export====================")
+            return
+
+        if mode == "memory":
+            print("====================Starting in-memory convert/transform/merge====================")
+            with _stage("memory"):
+                run_in_memory(output_dir=FINAL_DIR, extractor=CONVERT_EXTRACTOR, workers=CONVERT_WORKERS,
+                              timeout=CONVERT_TIMEOUT, batch_size=CONVERT_BATCH_SIZE, debug_dir=DEBUG_DIR,
+                              state_db=STATE_DB, id_map=id_map)
+            print("====================Done in-memory convert/transform/merge====================")
+        else:
+            run_file_stages(id_map)
+
+        print("====================Starting Exporting Excel Files To DB ====================")
+        with _stage("export"):
+            export_excels_to_postgres(FINAL_DIR, loader=EXPORT_LOADER, workers=EXPORT_WORKERS,
+                                      atomic_swap=EXPORT_ATOMIC_SWAP, state_db=STATE_DB)
+        print("====================Done Exporting Excel Files To DB ====================")
+    finally:
+        report = os.path.join(REPORT_DIR, f"run_{datetime.now():%Y%m%d_%H%M%S}")
+        write_report(report + ".json")
+        write_report(report + ".csv")
+        print(format_stages())
+        print(f"Run report written to {report}.json / .csv")
+
+
+def run_file_stages(id_map=None):
     print("====================Starting converting PDFS====================")
-    # convert_pdfs()
+    with _stage("convert"):
+        convert_pdfs(workers=CONVERT_WORKERS, timeout=CONVERT_TIMEOUT, batch_size=CONVERT_BATCH_SIZE,
+                     extractor=CONVERT_EXTRACTOR, state_db=STATE_DB, shard_pages=CONVERT_SHARD_PAGES)
     print("====================Done converting PDFS====================")
 
     print("====================Starting transforming Excel Files====================")
-    # transform_excels()
+    with _stage("transform"):
+        transform_excels(state_db=STATE_DB)
     print("====================Done transforming Excel Files====================")
 
     print("====================Starting Final transforming Excel Files====================")
-    # apply_final_transformations()
+    with _stage("final"):
+        apply_final_transformations(state_db=STATE_DB)
     print("====================Done Final transforming Excel Files====================")
 
     print("====================Starting Merging Excel Files====================")
-    # merge_excels()
+    with _stage("merge"):
+        merge_excels(state_db=STATE_DB, id_map=id_map)
     print("====================Done Merging Excel Files====================")
 
-    print("====================Starting Renaming Excel Files====================")
-    rename_merged_files(identifier_to_district,
-                        ext=RENAME_SUFFIX, overwrite=OVERWRITE)
-    print("====================Done Renaming Excel Files====================")
-
-    print("====================Starting Exporting Excel Files To DB ====================")
-    export_excels_to_postgres(FINAL_DIR)
-    print("====================Done Exporting Excel Files To DB ====================")
-
 
 if __name__ == "__main__":
     run_pdf_to_excel_converter()
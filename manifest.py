@@ -0,0 +1,81 @@
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+# Default state store, kept in the pipeline's working directory
+STATE_DB = "pipeline_state.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_state (
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    output TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (stage, key)
+)
+"""
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Content hash of a file."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def combined_hash(hashes: Dict[str, str]) -> str:
+    """Hash of a set of named hashes (e.g. the members of a merge group)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(hashes):
+        digest.update(f"{name}\0{hashes[name]}\n".encode())
+    return digest.hexdigest()
+
+
+def open_manifest(path: Optional[str] = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or STATE_DB)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def recorded(conn: sqlite3.Connection, stage: str) -> Dict[str, tuple]:
+    """key -> (input_hash, output) for everything recorded for a stage."""
+    rows = conn.execute("SELECT key, input_hash, output FROM stage_state WHERE stage = ?", (stage,))
+    return {key: (input_hash, output) for key, input_hash, output in rows}
+
+
+def changed(conn: sqlite3.Connection, stage: str, hashes: Dict[str, str],
+            check_output: bool = True) -> Dict[str, str]:
+    """
+    Subset of hashes (key -> current input hash) that must be (re)processed:
+    new keys, keys whose input hash differs from the recorded one and, with
+    check_output, keys whose recorded output file no longer exists.
+    """
+    state = recorded(conn, stage)
+    result = {}
+    for key, input_hash in hashes.items():
+        previous = state.get(key)
+        if (previous is None or previous[0] != input_hash
+                or (check_output and previous[1] and not os.path.exists(previous[1]))):
+            result[key] = input_hash
+    return result
+
+
+def changed_files(conn: sqlite3.Connection, stage: str, directory: str, fnames: Iterable[str],
+                  check_output: bool = True) -> Dict[str, str]:
+    """changed() for files in a directory, keyed by file name."""
+    hashes = {fname: file_hash(os.path.join(directory, fname)) for fname in fnames}
+    return changed(conn, stage, hashes, check_output)
+
+
+def record(conn: sqlite3.Connection, stage: str, key: str, input_hash: str, output: Optional[str] = None) -> None:
+    """Record that `key` was processed by `stage` from input_hash into output."""
+    conn.execute(
+        "INSERT OR REPLACE INTO stage_state (stage, key, input_hash, output, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (stage, key, input_hash, str(output) if output else None, datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
@@ -1,8 +1,14 @@
 import os
-import re
 import logging
+import numpy as np
 import pandas as pd
-from typing import List, Optional, Dict
+from typing import Iterator, List, Optional, Dict
+from pandas.api.types import union_categoricals
+from catalog import district_filename, group_by_district, parse_register_name, scan_registers, unique_districts
+from consolidate import typed_records
+from instrumentation import file_size, files_size, track
+from manifest import changed, combined_hash, file_hash, open_manifest, record
+from table_io import read_table, stage_suffix, write_excel, write_excel_stream
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s: %(message)s")
@@ -11,14 +17,14 @@ ROW_LIMIT_PER_SHEET = 1_024_000
 
 
 def extract_identifier(filename: str) -> Optional[str]:
-    match = re.search(r'NVR_REGISTER_TXT_([^_\.]+)', filename)
-    return match.group(1) if match else None
+    register = parse_register_name(filename)
+    return register.district if register else None
 
 
-def group_files_by_identifier(filenames: List[str]) -> Dict[str, List[str]]:
+def group_files_by_identifier(filenames: List[str], suffix: str = '.xlsx') -> Dict[str, List[str]]:
     groups = {}
     for fname in filenames:
-        if fname.lower().endswith('.xlsx'):
+        if fname.lower().endswith(suffix):
             identifier = extract_identifier(fname)
             if identifier:
                 groups.setdefault(identifier, []).append(fname)
@@ -28,28 +34,154 @@ def group_files_by_identifier(filenames: List[str]) -> Dict[str, List[str]]:
     return groups
 
 
-def save_dataframe_to_excel(df: pd.DataFrame, output_path: str, row_limit: int = ROW_LIMIT_PER_SHEET) -> None:
+def save_dataframe_to_excel(df: pd.DataFrame, output_path: str, row_limit: int = ROW_LIMIT_PER_SHEET) -> int:
+    """
+    Write df to output_path, rolling over to a new sheet every row_limit
+    rows. Returns the number of sheets written, 0 if df is empty (nothing is
+    saved). A failed write is logged and re-raised.
+    """
     n_rows = len(df)
     if n_rows == 0:
         logging.warning(f"No data to save for {output_path}. Skipping file.")
-        return
+        return 0
     try:
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            for i in range((n_rows + row_limit - 1) // row_limit):
-                start, end = i * row_limit, min((i + 1) * row_limit, n_rows)
-                sheet_name = f"Sheet{i+1}"
-                df.iloc[start:end].to_excel(
-                    writer, index=False, sheet_name=sheet_name)
-            logging.info(
-                f"Saved to {output_path} with {((n_rows + row_limit - 1) // row_limit)} sheet(s).")
+        n_sheets = write_excel(df, output_path, row_limit=row_limit)
+        logging.info(
+            f"Saved to {output_path} with {n_sheets} sheet(s).")
     except Exception as e:
         logging.error(f"Failed to save Excel file '{output_path}': {e}")
+        raise
+    return n_sheets
+
+
+def _read_group(files: Dict[str, str], file_format: Optional[str] = None,
+                unreadable: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read the files of one group (name -> path) one at a time, tagged with
+    '__sourcefile__' and aligned to the columns of the first readable file.
+    Files that can't be read are logged, skipped and added to unreadable.
+    """
+    columns = None
+    for fname, full_path in files.items():
+        try:
+            df = typed_records(read_table(full_path, file_format))
+        except Exception as e:
+            logging.error(f"Could not read '{fname}': {e}")
+            if unreadable is not None:
+                unreadable.append(fname)
+            continue
+        df.columns = [str(c) for c in df.columns]
+        if columns is None:
+            columns = list(df.columns)
+        else:
+            extra = [c for c in df.columns if c not in columns]
+            if extra:
+                logging.warning(f"Dropping columns {extra} of '{fname}' not present in the first file.")
+            df = df.reindex(columns=columns)
+        df['__sourcefile__'] = fname
+        yield df
 
 
-def merge_excels(input_dir: str = 'final', output_dir: str = 'merged', row_limit: int = ROW_LIMIT_PER_SHEET) -> None:
+def stream_merge_to_excel(files: Dict[str, str], output_path: str, row_limit: int = ROW_LIMIT_PER_SHEET,
+                          file_format: Optional[str] = None, unreadable: Optional[List[str]] = None) -> int:
+    """
+    Append the rows of each file (name -> path) to a write-only workbook as
+    soon as it is read, rolling over to a new sheet every row_limit rows.
+    Only one input file is held in memory at a time. The columns of the
+    first readable file (plus '__sourcefile__') are used for every sheet.
+    The names of files that can't be read are added to unreadable.
+    Returns the number of rows written; nothing is saved if it is 0.
+    """
+    n_rows = write_excel_stream(_read_group(files, file_format, unreadable), output_path, row_limit)
+    if n_rows == 0:
+        logging.warning(f"No data to save for {output_path}. Skipping file.")
+    return n_rows
+
+
+def _union_categories(frames: List[pd.DataFrame]) -> List[pd.DataFrame]:
+    """
+    The frames with each column that is categorical in all of them set to
+    the union of their categories, so concatenating them keeps it categorical
+    instead of falling back to object.
+    """
+    for name in frames[0].columns if frames else []:
+        cols = [df[name] for df in frames if name in df.columns]
+        if len(cols) == len(frames) and all(isinstance(c.dtype, pd.CategoricalDtype) for c in cols):
+            categories = union_categoricals(cols, ignore_order=True).categories
+            for df in frames:
+                df[name] = df[name].cat.set_categories(categories)
+    return frames
+
+
+def merge_frames(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Stack the frames of one identifier group, tagging each row with the
+    name of the file it came from in a categorical '__sourcefile__' column
+    (added to the given frames in place). Categorical columns stay
+    categorical in the result.
+    """
+    merged_rows = []
+    for fname, df in frames.items():
+        df['__sourcefile__'] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[fname])
+        merged_rows.append(df)
+    return pd.concat(_union_categories(merged_rows), ignore_index=True)
+
+
+def _merge_group(identifier: str, filelist: List[str], input_dir: str, output_file: str, row_limit: int,
+                 streaming: bool, file_format: Optional[str], metrics: Dict) -> None:
+    """
+    Merge one identifier group into output_file, filling metrics' rows_out
+    and status. The status is only "ok" if every member was read and the
+    output was written by this call, so a partial or failed merge is redone
+    on the next incremental run.
+    """
+    unreadable = []
+    try:
+        if streaming:
+            metrics["rows_out"] = stream_merge_to_excel(
+                {fname: os.path.join(input_dir, fname) for fname in filelist}, output_file, row_limit,
+                file_format, unreadable)
+        else:
+            frames = {}
+            for fname in filelist:
+                try:
+                    frames[fname] = typed_records(read_table(os.path.join(input_dir, fname), file_format))
+                except Exception as e:
+                    logging.error(f"Could not read '{fname}': {e}")
+                    unreadable.append(fname)
+            big_df = merge_frames(frames) if frames else pd.DataFrame()
+            metrics["rows_out"] = len(big_df) if save_dataframe_to_excel(big_df, output_file, row_limit) else 0
+    except Exception as e:
+        metrics["status"] = "failed"
+        logging.error(
+            f"Error during merging/writing for '{identifier}': {e}")
+        return
+
+    if unreadable:
+        metrics["status"] = "failed"
+        logging.error(f"{len(unreadable)} of {len(filelist)} files of group '{identifier}' could not be read "
+                      f"and are missing from {output_file}: {unreadable}")
+    elif not metrics["rows_out"]:
+        # Nothing written (already logged), so output_file isn't this run's
+        metrics["status"] = "failed"
+
+
+def merge_excels(input_dir: str = 'final', output_dir: str = 'merged', row_limit: int = ROW_LIMIT_PER_SHEET,
+                 streaming: bool = True, state_db: Optional[str] = None,
+                 file_format: Optional[str] = None, id_map: Optional[Dict[str, str]] = None) -> None:
     """
     Groups, merges, and writes Excel files from input_dir to output_dir.
-    Each group (by identifier) is saved to one or more Excel sheets (if >1,024,000 rows).
+    Each group (by identifier) is saved to one or more Excel sheets (if >1,024,000 rows),
+    as <district>.xlsx if id_map (identifier -> district name, see
+    catalog.load_district_map) names it and as merged_<identifier>.xlsx otherwise,
+    also for identifiers sharing a district name (see catalog.unique_districts).
+    The groups come from one catalog.scan_registers pass over input_dir.
+    With streaming=True each file's rows are appended to the output as it is
+    read, so peak memory is bounded by one input file instead of the group.
+    With a state_db manifest (see manifest.py) a group is only rebuilt when a
+    member file was added, removed or changed since its last merge.
+    The input files are in file_format (see table_io.INTERMEDIATE_FORMAT);
+    the merged output is always .xlsx.
     """
     if not os.path.exists(input_dir):
         logging.error(f"Input dir '{input_dir}' does not exist! Exiting.")
@@ -58,36 +190,37 @@ def merge_excels(input_dir: str = 'final', output_dir: str = 'merged', row_limit
     os.makedirs(output_dir, exist_ok=True)
 
     try:
-        all_files = os.listdir(input_dir)
+        registers = scan_registers(input_dir, stage_suffix(file_format))
     except Exception as e:
         logging.error(f"Cannot list files in '{input_dir}': {e}")
         return
 
-    groups = group_files_by_identifier(all_files)
+    groups = {identifier: [f.name for f in files] for identifier, files in group_by_district(registers).items()}
     if not groups:
         logging.info(
             "No matching Excel files by identifier found. Nothing to merge.")
         return
+    id_map = unique_districts(id_map or {})
+
+    manifest = open_manifest(state_db) if state_db else None
+    if manifest:
+        # The merged files may be renamed after merging, so only the inputs are compared
+        group_hashes = changed(manifest, "merge", {
+            identifier: combined_hash({fname: file_hash(os.path.join(input_dir, fname)) for fname in filelist})
+            for identifier, filelist in groups.items()
+        }, check_output=False)
+        logging.info(f"{len(groups) - len(group_hashes)} of {len(groups)} merge groups unchanged, skipping them")
+        groups = {identifier: groups[identifier] for identifier in group_hashes}
 
     for identifier, filelist in groups.items():
-        merged_rows = []
-        for fname in filelist:
-            full_path = os.path.join(input_dir, fname)
-            try:
-                df = pd.read_excel(full_path, engine='openpyxl')
-                df['__sourcefile__'] = fname
-                merged_rows.append(df)
-            except Exception as e:
-                logging.error(f"Could not read '{fname}': {e}")
-        if merged_rows:
-            try:
-                big_df = pd.concat(merged_rows, ignore_index=True)
-                output_file = os.path.join(
-                    output_dir, f"merged_{identifier}.xlsx")
-                save_dataframe_to_excel(big_df, output_file, row_limit)
-            except Exception as e:
-                logging.error(
-                    f"Error during merging/writing for '{identifier}': {e}")
-        else:
-            logging.warning(
-                f"Nothing to merge for group {identifier}. Skipping output.")
+        output_file = os.path.join(output_dir, district_filename(identifier, id_map))
+        with track("merge", os.path.basename(output_file)) as metrics:
+            metrics["bytes_in"] = files_size(os.path.join(input_dir, fname) for fname in filelist)
+            _merge_group(identifier, filelist, input_dir, output_file, row_limit, streaming,
+                         file_format, metrics)
+            metrics["bytes_out"] = file_size(output_file)
+        if manifest and metrics["status"] == "ok":
+            record(manifest, "merge", identifier, group_hashes[identifier], output_file)
+
+    if manifest:
+        manifest.close()
@@ -1,28 +1,257 @@
 import tabula
+import pdfplumber
 import pandas as pd
 import os
 from pathlib import Path
+from PyPDF2 import PdfReader
+from table_io import stage_suffix, write_table_sheets
+from instrumentation import file_size, record_file
+from manifest import changed_files, open_manifest, record
+from workers import imap_jobs, run_sequential, summarize
+
+# Options for the JVM that tabula-java runs in. It is started once per
+# worker process and reused for every PDF that worker converts.
+JAVA_OPTIONS = ["-Xmx2g", "-Djava.awt.headless=true", "-Dfile.encoding=UTF8"]
+
+def start_jvm(java_options=None):
+    """
+    Start tabula's JVM in this process through jpype so that every later
+    tabula.read_pdf call reuses it instead of launching java per file.
+    Falls back to tabula's own (subprocess) handling if jpype is unavailable.
+    """
+    try:
+        import jpype
+    except ImportError as e:
+        print(f"jpype unavailable, tabula will start java per file: {e}")
+        return False
+    if not jpype.isJVMStarted():
+        jpype.addClassPath(tabula.backend.jar_path())
+        jpype.startJVM(*(java_options or JAVA_OPTIONS), convertStrings=False)
+    return True
+
+# Table finding settings for the fixed-layout NVR register pages: columns and
+# rows are inferred from the word positions since the pages have no ruling lines.
+PDFPLUMBER_TABLE_SETTINGS = {
+    "vertical_strategy": "text",
+    "horizontal_strategy": "text",
+    "text_x_tolerance": 2,
+    "text_y_tolerance": 2,
+    "intersection_tolerance": 5,
+}
+
+# PDFs with more pages than this are split into page ranges of this size that
+# are extracted concurrently when converting on a worker pool (None: never split)
+SHARD_PAGES = 100
+
+def extract_tables_tabula(pdf_file_path, pages=None):
+    """
+    Extract all tables of a PDF, or of the (first, last) 1-based page range
+    `pages`, with tabula-java (needs a JVM).
+    """
+    pages = f"{pages[0]}-{pages[1]}" if pages else 'all'
+    return tabula.read_pdf(pdf_file_path, pages=pages, force_subprocess=False)
+
+def extract_tables_pdfplumber(pdf_file_path, table_settings=None, pages=None):
+    """
+    Extract tables with pdfplumber, one page at a time.
+
+    Yields one DataFrame per page, shaped like tabula's output (first row as
+    header), and releases each page's parsed objects before moving on so
+    memory stays flat on long registers. `pages` optionally limits the
+    extraction to a (first, last) 1-based page range.
+    """
+    settings = table_settings or PDFPLUMBER_TABLE_SETTINGS
+    page_numbers = list(range(pages[0], pages[1] + 1)) if pages else None
+    with pdfplumber.open(pdf_file_path, pages=page_numbers) as pdf:
+        for page in pdf.pages:
+            rows = page.extract_table(settings)
+            page.close()
+            # The text strategy yields empty rows for the gaps between lines
+            rows = [row for row in rows or [] if any(cell not in (None, '') for cell in row)]
+            if rows:
+                yield pd.DataFrame(rows[1:], columns=rows[0])
+
+# Available extraction backends, selectable by name in convert_pdfs/pdf_to_excel.
+# Each takes a PDF path (and optional pages=(first, last) range) and returns
+# an iterable of DataFrames in page order.
+EXTRACTORS = {
+    "tabula": extract_tables_tabula,
+    "pdfplumber": extract_tables_pdfplumber,
+}
+
+def page_count(pdf_file_path):
+    # Only reads the page tree, none of the page contents
+    return len(PdfReader(pdf_file_path).pages)
+
+def page_ranges(n_pages, shard_pages):
+    """(first, last) 1-based page ranges of at most shard_pages pages covering n_pages."""
+    return [(first, min(first + shard_pages - 1, n_pages)) for first in range(1, n_pages + 1, shard_pages)]
+
+def extract_shard(pdf_file_path, extractor, pages):
+    """Tables of one page range of a PDF, for reassembly by convert_pdfs."""
+    return list(EXTRACTORS[extractor](pdf_file_path, pages=pages))
+
+def _convert_job(pdf_file_path, excel_file_path, extractor, file_format, pages=None):
+    # Whole PDFs are written by the worker, shards are sent back to be reassembled
+    if pages is None:
+        return pdf_to_excel(pdf_file_path, excel_file_path, extractor, file_format)
+    return extract_shard(pdf_file_path, extractor, pages)
+
+def convert_pdfs(input_dir="original", output_dir="converted", workers=1, timeout=None,
+                 batch_size=1, java_options=None, extractor="tabula", state_db=None,
+                 file_format=None, shard_pages=SHARD_PAGES):
+    """
+    Convert every PDF in input_dir to a stage file (Excel by default) in output_dir.
+
+    Parameters:
+    input_dir (str): Directory with the source PDFs
+    output_dir (str): Directory for the converted Excel files
+    workers (int): Number of worker processes; 1 converts in-process
+    timeout (float): Per-file timeout in seconds (runs in a worker process)
+    batch_size (int): Number of PDFs handed to a worker's JVM at a time
+    java_options (list): JVM options, defaults to JAVA_OPTIONS
+    extractor (str): Extraction backend, one of EXTRACTORS
+    state_db (str): SQLite manifest (see manifest.py); if given, PDFs whose
+        content is unchanged since their last successful conversion are skipped
+    file_format (str): Output format, one of table_io.FORMAT_SUFFIXES
+        (default table_io.INTERMEDIATE_FORMAT)
+    shard_pages (int): On a worker pool, PDFs with more pages are split into
+        page ranges of this size that are extracted concurrently and
+        reassembled in page order (None: one job per PDF). The timeout then
+        applies per page range.
+
+    Returns:
+    list: One result record per PDF (see workers.imap_jobs)
+    """
+    if extractor not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor '{extractor}', expected one of {list(EXTRACTORS)}")
 
-def convert_pdfs(input_dir="original", output_dir="converted"):
     # Create output directory if it doesn't exist
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     # Get list of PDF files in input directory
     pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
+    manifest = open_manifest(state_db) if state_db else None
+    if manifest:
+        hashes = changed_files(manifest, "convert", input_dir, pdf_files)
+        print(f"{len(pdf_files) - len(hashes)} of {len(pdf_files)} PDFs unchanged, skipping them")
+        pdf_files = [f for f in pdf_files if f in hashes]
+    jobs = [
+        (pdf_file, (os.path.join(input_dir, pdf_file),
+                    os.path.join(output_dir, f"{Path(pdf_file).stem}{stage_suffix(file_format)}"),
+                    extractor, file_format))
+        for pdf_file in pdf_files
+    ]
+
+    paths = {key: args[:2] for key, args in jobs}
+
+    # Only the tabula backend needs a JVM in the converting process
+    initializer = start_jvm if extractor == "tabula" else None
+
+    # A timeout can only be enforced from outside the converting process
+    if workers <= 1 and timeout is None:
+        if initializer:
+            initializer(java_options)
+        runner = run_sequential(_convert_job, jobs)
+        shards = {}
+    else:
+        jobs, shards = _shard_jobs(jobs, shard_pages)
+        runner = imap_jobs(_convert_job, jobs, workers=workers, timeout=timeout,
+                           batch_size=batch_size, initializer=initializer,
+                           initargs=(java_options,))
+
+    results = []
+    for result in _reassemble(runner, shards, file_format):
+        results.append(result)
+        # CPU time and memory of the workers only show up in the stage totals
+        pdf_path, output_path = paths[result["key"]]
+        record_file("convert", result["key"], status=result["status"], wall_seconds=round(result["elapsed"], 4),
+                    bytes_in=file_size(pdf_path),
+                    bytes_out=file_size(output_path) if result["status"] == "ok" else None)
+        if result["status"] == "ok":
+            print(f"Converted: {result['key']} -> {result['value']}")
+            if manifest:
+                record(manifest, "convert", result["key"], hashes[result["key"]], result["value"])
+        else:
+            print(f"Failed: {result['key']} ({result['status']}: {result['error']})")
+
+    print(summarize(results))
+    if manifest:
+        manifest.close()
+    return results
+
+def _shard_jobs(jobs, shard_pages):
+    """
+    Split the jobs of PDFs longer than shard_pages into one job per page
+    range. Returns the new job list (largest PDFs' shards first) and
+    shard key -> (pdf key, shard index, shard count, output path).
+    """
+    if not shard_pages:
+        return jobs, {}
+    whole, split, shards = [], [], {}
+    for key, (pdf_file_path, excel_file_path, extractor, file_format) in jobs:
+        try:
+            n_pages = page_count(pdf_file_path)
+        except Exception as e:
+            print(f"Could not count pages of {key}, converting it whole: {e}")
+            n_pages = 0
+        if n_pages <= shard_pages:
+            whole.append((key, (pdf_file_path, excel_file_path, extractor, file_format)))
+            continue
+        ranges = page_ranges(n_pages, shard_pages)
+        print(f"Splitting {key} ({n_pages} pages) into {len(ranges)} page ranges")
+        for i, pages in enumerate(ranges):
+            shard_key = f"{key} [pages {pages[0]}-{pages[1]}]"
+            shards[shard_key] = (key, i, len(ranges), excel_file_path)
+            split.append((n_pages, shard_key, (pdf_file_path, excel_file_path, extractor, file_format, pages)))
+    # Long PDFs go first so their shards don't trail behind the short files
+    split.sort(key=lambda job: -job[0])
+    return [job[1:] for job in split] + whole, shards
 
-    for pdf_file in pdf_files:
-        input_path = os.path.join(input_dir, pdf_file)
-        output_path = os.path.join(output_dir, f"{Path(pdf_file).stem}.xlsx")
+def _reassemble(runner, shards, file_format):
+    """
+    Pass whole-PDF results through and combine the shard results of each
+    split PDF: once all its page ranges are in, the tables are written in
+    page order and one result record is yielded for the PDF.
+    """
+    parts = {}
+    for result in runner:
+        if result["key"] not in shards:
+            yield result
+            continue
+        key, index, count, excel_file_path = shards[result["key"]]
+        done = parts.setdefault(key, {})
+        done[index] = result
+        if len(done) < count:
+            continue
+        del parts[key]
+        elapsed = sum(r["elapsed"] for r in done.values())
+        failed = [r for _, r in sorted(done.items()) if r["status"] != "ok"]
+        if failed:
+            errors = "; ".join(f"{r['key']}: {r['status']} {r['error']}" for r in failed)
+            yield {"key": key, "status": failed[0]["status"], "elapsed": elapsed, "error": errors, "value": None}
+            continue
+        tables = (table for i in range(count) for table in done.pop(i)["value"])
+        try:
+            value = save_tables(tables, excel_file_path, file_format)
+            yield {"key": key, "status": "ok", "elapsed": elapsed, "error": None, "value": value}
+        except Exception as e:
+            yield {"key": key, "status": "failed", "elapsed": elapsed, "error": f"{type(e).__name__}: {e}", "value": None}
 
-        # Convert PDF to Excel
-        pdf_to_excel(input_path, output_path)
-        print(f"Converted: {pdf_file} -> {output_path}")
+def pdf_to_excel(pdf_file_path, excel_file_path, extractor="tabula", file_format=None):
+    # Read PDF file (tabula reuses this process's JVM once start_jvm has run)
+    tables = EXTRACTORS[extractor](pdf_file_path)
+    return save_tables(tables, excel_file_path, file_format)
 
-def pdf_to_excel(pdf_file_path, excel_file_path):
-    # Read PDF file
-    tables = tabula.read_pdf(pdf_file_path, pages='all')
+def save_tables(tables, excel_file_path, file_format=None):
+    # Write each table to a separate sheet in the Excel file (or stacked, see write_table_sheets)
+    write_table_sheets(tables, excel_file_path, index=True, file_format=file_format)
+    return excel_file_path
 
-    # Write each table to a separate sheet in the Excel file
-    with pd.ExcelWriter(excel_file_path) as writer:
-        for i, table in enumerate(tables):
-            table.to_excel(writer, sheet_name=f'Sheet{i+1}')
+def tables_to_sheets(tables):
+    """
+    Shape extracted tables like pd.read_excel(sheet_name=None) returns them
+    from a converted file (index written as the first column), so they can be
+    handed to the transform stage without the Excel round-trip.
+    """
+    return {f'Sheet{i+1}': table.reset_index() for i, table in enumerate(tables)}
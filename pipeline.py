@@ -0,0 +1,378 @@
+import os
+import logging
+import queue
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from consolidate import parse_records, save_rejected_rows
+from export_to_db import export_excel_file
+from instrumentation import file_size, record_file, track
+from manifest import changed, combined_hash, file_hash, open_manifest, record
+from catalog import district_filename, group_by_district, scan_registers, unique_districts
+from merge import ROW_LIMIT_PER_SHEET, merge_frames, save_dataframe_to_excel
+from pdftoexcel import EXTRACTORS, save_tables, start_jvm, tables_to_sheets
+from table_io import stage_suffix, write_table
+from transform import clean_sheets, save_transformed
+from workers import imap_jobs, run_sequential, summarize
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s %(levelname)s: %(message)s")
+
+# Items (merge groups, merged files) waiting between the overlapped stages of
+# run_overlapped; a full queue blocks the stage feeding it
+OVERLAP_QUEUE_SIZE = 2
+
+
+def stage_names(pdf_file: str, file_format: Optional[str] = None) -> Dict[str, str]:
+    """
+    File names the file-based pipeline gives a PDF at each stage.
+    """
+    converted = f"{Path(pdf_file).stem}{stage_suffix(file_format)}"
+    transformed = f"transformed_{converted}"
+    return {"converted": converted, "transformed": transformed, "final": f"final_{transformed}"}
+
+
+def process_pdf(pdf_path: str, extractor: str = "tabula", debug_dir: Optional[str] = None) -> Tuple[Optional[pd.DataFrame], List[pd.DataFrame]]:
+    """
+    Run convert -> transform -> final on one PDF entirely in memory and
+    return the final voter records (None if the PDF has no usable data)
+    together with the rejected rows (see consolidate.parse_records).
+
+    If debug_dir is given, the intermediate files are also written to its
+    converted/, transformed/ and final/ subdirectories (in table_io.INTERMEDIATE_FORMAT).
+    """
+    names = stage_names(os.path.basename(pdf_path))
+    debug = {stage: Path(debug_dir) / stage for stage in names} if debug_dir else {}
+    for path in debug.values():
+        path.mkdir(parents=True, exist_ok=True)
+
+    tables = list(EXTRACTORS[extractor](pdf_path))
+    if debug:
+        save_tables(tables, debug["converted"] / names["converted"])
+
+    transformed = clean_sheets(tables_to_sheets(tables))
+    if transformed is None:
+        return None, []
+    if debug:
+        save_transformed(transformed, debug["transformed"] / names["transformed"])
+
+    # Same positional layout as reading the transformed file with header=None, skiprows=1
+    error_log = []
+    final = parse_records(transformed.set_axis(range(transformed.shape[1]), axis=1),
+                          error_log, names["transformed"])
+    if debug:
+        write_table(final, debug["final"] / names["final"])
+    return final, error_log
+
+
+def changed_groups(manifest, input_dir: str, pdf_groups: Dict[str, List[str]]) -> Dict[str, str]:
+    """
+    Identifier -> combined hash of the PDF groups (identifier -> file names)
+    with a new, removed or changed member since they were last recorded
+    under the "memory" stage.
+    """
+    group_hashes = changed(manifest, "memory", {
+        identifier: combined_hash({f: file_hash(os.path.join(input_dir, f)) for f in members})
+        for identifier, members in pdf_groups.items()
+    }, check_output=False)
+    logging.info(f"{len(pdf_groups) - len(group_hashes)} of {len(pdf_groups)} groups unchanged, skipping them")
+    return group_hashes
+
+
+def _pdf_groups(input_dir: str, manifest) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    # Identifier -> PDF names to process (all, or the changed groups with a
+    # manifest) and their group hashes, from one catalog scan of input_dir
+    pdf_groups = {identifier: [f.name for f in files]
+                  for identifier, files in group_by_district(scan_registers(input_dir, '.pdf')).items()}
+    if not manifest:
+        return pdf_groups, {}
+    group_hashes = changed_groups(manifest, input_dir, pdf_groups)
+    return {identifier: pdf_groups[identifier] for identifier in group_hashes}, group_hashes
+
+
+def _process_pdfs(input_dir, pdf_files, extractor, workers, timeout, batch_size, debug_dir):
+    # process_pdf over pdf_files, in-process or on a worker pool, yielding result records
+    jobs = [(pdf_file, (os.path.join(input_dir, pdf_file), extractor, debug_dir)) for pdf_file in pdf_files]
+    initializer = start_jvm if extractor == "tabula" else None
+    if workers <= 1 and timeout is None:
+        if initializer:
+            initializer()
+        return run_sequential(process_pdf, jobs)
+    return imap_jobs(process_pdf, jobs, workers=workers, timeout=timeout,
+                     batch_size=batch_size, initializer=initializer)
+
+
+def _collect_result(result: Dict, input_dir: str, stage: str, error_log: List[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """
+    Record and log one process_pdf result record, adding its rejected rows
+    to error_log. Returns its final records, None if it failed or has none.
+    """
+    final = result["value"][0] if result["status"] == "ok" else None
+    record_file(stage, result["key"], status=result["status"], wall_seconds=round(result["elapsed"], 4),
+                bytes_in=file_size(os.path.join(input_dir, result["key"])),
+                rows_out=None if final is None else len(final))
+    if result["status"] != "ok":
+        logging.error(f"Failed: {result['key']} ({result['status']}: {result['error']})")
+        return None
+    final, rejected = result["value"]
+    error_log.extend(rejected)
+    n_rejected = sum(len(r) for r in rejected)
+    if final is None or final.empty:
+        logging.warning(f"No records in {result['key']} ({n_rejected} rejected)")
+        return None
+    logging.info(f"{result['key']}: {len(final)} accepted, {n_rejected} rejected")
+    return final
+
+
+def _completed_groups(runner, pdf_groups: Dict[str, List[str]], input_dir: str, stage: str,
+                      results: List[Dict], error_log: List[pd.DataFrame]):
+    """
+    Collect the process_pdf result records of runner (see _collect_result)
+    into results and error_log, and yield each group of pdf_groups as
+    (identifier, final records by final file name, complete) as soon as its
+    last member is done, so only the groups still in progress are held in
+    memory. complete is False if one of the group's PDFs failed; groups
+    without any records are not yielded.
+    """
+    district = {pdf_file: identifier for identifier, members in pdf_groups.items() for pdf_file in members}
+    # Members of each group still being processed
+    waiting = {identifier: set(members) for identifier, members in pdf_groups.items()}
+    finals: Dict[str, Dict[str, pd.DataFrame]] = {}
+    failed = set()
+    for result in runner:
+        results.append({**result, "value": None})
+        identifier = district[result["key"]]
+        if result["status"] != "ok":
+            failed.add(identifier)
+        final = _collect_result(result, input_dir, stage, error_log)
+        if final is not None:
+            finals.setdefault(identifier, {})[stage_names(result["key"])["final"]] = final
+        waiting[identifier].discard(result["key"])
+        if not waiting[identifier]:
+            del waiting[identifier]
+            group = finals.pop(identifier, None)
+            if group:
+                yield identifier, dict(sorted(group.items())), identifier not in failed
+
+
+def _save_rejected(error_log: List[pd.DataFrame], rejected_path: str, results: List[Dict], manifest) -> None:
+    # With a manifest only some groups were processed, so the rejected rows
+    # of their PDFs replace the earlier ones and the others' are kept
+    replaced = [stage_names(r["key"])["transformed"] for r in results if r["status"] == "ok"] if manifest else None
+    written = save_rejected_rows(error_log, rejected_path, replaced)
+    if written:
+        logging.info(f"Wrote {written} rejected rows to {rejected_path}")
+
+
+def _merge_finals(identifier: str, finals: Dict[str, pd.DataFrame], output_dir: str, row_limit: int,
+                  id_map: Optional[Dict[str, str]] = None) -> Optional[str]:
+    """
+    Merge one group's final records into its district file (see
+    catalog.district_filename); returns its path, None if it wasn't
+    written by this call (a file left from an earlier run doesn't count).
+    """
+    output_file = os.path.join(output_dir, district_filename(identifier, id_map))
+    try:
+        with track("merge", os.path.basename(output_file)) as metrics:
+            big_df = merge_frames(finals)
+            n_sheets = save_dataframe_to_excel(big_df, output_file, row_limit)
+            metrics.update(rows_in=len(big_df), rows_out=len(big_df) if n_sheets else 0,
+                           bytes_out=file_size(output_file) if n_sheets else None)
+    except Exception as e:
+        logging.error(f"Error during merging/writing for '{identifier}': {e}")
+        return None
+    return output_file if n_sheets else None
+
+
+def run_in_memory(
+    input_dir: str = "original",
+    output_dir: str = "merged",
+    extractor: str = "tabula",
+    workers: int = 1,
+    timeout: Optional[float] = None,
+    batch_size: int = 1,
+    debug_dir: Optional[str] = None,
+    row_limit: int = ROW_LIMIT_PER_SHEET,
+    rejected_path: Optional[str] = "rejected/rejected_rows.csv",
+    state_db: Optional[str] = None,
+    id_map: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    Convert, transform, parse and merge the PDFs in input_dir, passing
+    DataFrames between stages instead of intermediate .xlsx files.
+    Writes the merged district files to output_dir like merge_excels (named
+    after id_map's districts, see catalog.district_filename and
+    catalog.unique_districts) and the
+    rejected rows to rejected_path like apply_final_transformations.
+
+    Each group is merged as soon as its last PDF is done, so only the final
+    records of the groups still being processed are held in memory.
+
+    With a state_db manifest (see manifest.py) only the groups with a new,
+    removed or changed PDF are processed. All PDFs of such a group are
+    re-read since there are no intermediate files to merge them from.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    manifest = open_manifest(state_db) if state_db else None
+    pdf_groups, group_hashes = _pdf_groups(input_dir, manifest)
+    pdf_files = [pdf_file for members in pdf_groups.values() for pdf_file in members]
+    id_map = unique_districts(id_map or {})
+    runner = _process_pdfs(input_dir, pdf_files, extractor, workers, timeout, batch_size, debug_dir)
+
+    results, error_log = [], []
+    for identifier, group, complete in _completed_groups(runner, pdf_groups, input_dir, "memory",
+                                                         results, error_log):
+        output_file = _merge_finals(identifier, group, output_dir, row_limit, id_map)
+        # A group with a failed PDF is retried on the next run
+        if output_file and manifest and complete:
+            record(manifest, "memory", identifier, group_hashes[identifier], output_file)
+    print(summarize(results))
+    if rejected_path:
+        _save_rejected(error_log, rejected_path, results, manifest)
+
+    if manifest:
+        manifest.close()
+
+
+def run_overlapped(
+    input_dir: str = "original",
+    output_dir: str = "merged",
+    extractor: str = "tabula",
+    workers: int = 1,
+    timeout: Optional[float] = None,
+    batch_size: int = 1,
+    debug_dir: Optional[str] = None,
+    row_limit: int = ROW_LIMIT_PER_SHEET,
+    rejected_path: Optional[str] = "rejected/rejected_rows.csv",
+    state_db: Optional[str] = None,
+    id_map: Optional[Dict[str, str]] = None,
+    engine=None,
+    schema: str = "pdf_to_excel_data",
+    if_exists: str = "replace",
+    loader: str = "copy",
+    atomic_swap: bool = True,
+    export_workers: int = 1,
+    queue_size: int = OVERLAP_QUEUE_SIZE,
+) -> Dict[str, List]:
+    """
+    run_in_memory and the export, with the stages overlapped: each merge
+    group is merged into its district file as soon as all of its PDFs are
+    processed and loaded into the database while the workers carry on with
+    the other PDFs.
+
+    A group with a failed PDF is merged but not exported, so its table
+    keeps its last complete load until the group is redone.
+
+    The worker pool (convert -> transform -> final per PDF) feeds a merge
+    thread, which feeds export_workers export threads, through queues of at
+    most queue_size items. A full queue blocks the stage before it, down to
+    the pool, which only takes on new PDFs while its results are consumed,
+    so a slow export holds back conversion instead of piling up frames.
+
+    Parameters:
+    id_map (dict): Identifier -> district name the merged files are named
+        after (see catalog.district_filename)
+    engine: SQLAlchemy engine to export to (see export_to_db.create_export_engine);
+        None skips the export
+    schema, if_exists, loader, atomic_swap: See export_to_db.export_excel_file
+    export_workers (int): Merged files loaded concurrently
+    queue_size (int): Capacity of the merge and export queues
+
+    Returns:
+    dict: 'merged' (output files) and 'exported' (export_excel_file results)
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    manifest = open_manifest(state_db) if state_db else None
+    pdf_groups, group_hashes = _pdf_groups(input_dir, manifest)
+    pdf_files = [pdf_file for members in pdf_groups.values() for pdf_file in members]
+    id_map = unique_districts(id_map or {})
+
+    merge_queue, export_queue = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=queue_size)
+    merged, exported = [], []
+    export_workers = max(1, export_workers) if engine is not None else 0
+
+    # Each stage thread drains its queue up to the sentinel whatever goes
+    # wrong with an item, or the stage feeding it would block on a full
+    # queue forever. Their manifest connections are opened in the thread
+    # (on first use) since sqlite3 connections can't be shared.
+    def merge_stage():
+        conn = None
+        try:
+            while (item := merge_queue.get()) is not None:
+                identifier, finals, complete = item
+                try:
+                    output_file = _merge_finals(identifier, finals, output_dir, row_limit, id_map)
+                    if output_file is None:
+                        continue
+                    merged.append(output_file)
+                    if export_workers and not complete:
+                        # The swap would replace the district's complete table with part of it
+                        logging.warning(f"Not exporting {os.path.basename(output_file)}: a PDF of group "
+                                        f"'{identifier}' failed, so its table keeps the last complete load")
+                    elif export_workers:
+                        export_queue.put((identifier, output_file, complete))
+                    elif state_db and complete:
+                        conn = conn or open_manifest(state_db)
+                        record(conn, "memory", identifier, group_hashes[identifier], output_file)
+                except Exception as e:
+                    logging.error(f"Error during merging for '{identifier}': {e}")
+        finally:
+            if conn:
+                conn.close()
+            for _ in range(export_workers):
+                export_queue.put(None)
+
+    def export_stage():
+        conn = None
+        try:
+            while (item := export_queue.get()) is not None:
+                identifier, path, complete = item
+                fname = os.path.basename(path)
+                try:
+                    result = export_excel_file(engine, path, schema, if_exists, loader, atomic_swap)
+                except Exception as e:
+                    logging.error(f"Failed to export {fname}: {e}")
+                    result = {"table": os.path.splitext(fname)[0].lower(), "rows": 0, "seconds": 0.0,
+                              "rows_per_sec": 0.0, "error": str(e)}
+                exported.append(result)
+                try:
+                    record_file("export", fname, status="failed" if "error" in result else "ok",
+                                wall_seconds=result["seconds"], rows_out=result["rows"], bytes_in=file_size(path))
+                    # A group counts as done once it is loaded; a group with a
+                    # failed PDF or export is redone on the next run
+                    if state_db and "error" not in result:
+                        conn = conn or open_manifest(state_db)
+                        record(conn, "export", fname, file_hash(path), f"{schema}.{result['table']}")
+                        if complete:
+                            record(conn, "memory", identifier, group_hashes[identifier], path)
+                except Exception as e:
+                    logging.error(f"Could not record the export of {fname}: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    threads = [threading.Thread(target=merge_stage, name="merge")]
+    threads += [threading.Thread(target=export_stage, name=f"export-{i}") for i in range(export_workers)]
+    for thread in threads:
+        thread.start()
+
+    results, error_log = [], []
+    try:
+        runner = _process_pdfs(input_dir, pdf_files, extractor, workers, timeout, batch_size, debug_dir)
+        # Each group is released to the merge thread when its last member is done
+        for item in _completed_groups(runner, pdf_groups, input_dir, "overlapped", results, error_log):
+            merge_queue.put(item)
+    finally:
+        merge_queue.put(None)
+        for thread in threads:
+            thread.join()
+        if manifest:
+            manifest.close()
+
+    print(summarize(results))
+    if rejected_path:
+        _save_rejected(error_log, rejected_path, results, manifest)
+    return {"merged": merged, "exported": exported}
@@ -1,31 +1,55 @@
 import os
 import logging
-import shutil
+from typing import Optional, Set
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s: %(message)s")
 
 
+def rename_merged_file(fname: str, id_map: dict, ext: str = '.xlsx', overwrite: bool = False,
+                       input_dir: str = 'merged', existing: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    Rename one merged_<identifier> file in input_dir to <district><ext>.
+    existing, if given, is the set of file names in input_dir (kept up to
+    date here), which saves a stat per file. Returns the new path, or None
+    if the file was left as it is.
+    """
+    identifier = fname[len("merged_"):].split('.')[0]
+    district = id_map.get(identifier)
+    if not district:
+        logging.warning(
+            f"No district for identifier '{identifier}' in {fname}. Skipping.")
+        return None
+    new_name = f"{district}{ext}"
+    src = os.path.join(input_dir, fname)
+    dst = os.path.join(input_dir, new_name)
+    if (new_name in existing) if existing is not None else os.path.exists(dst):
+        if overwrite:
+            logging.warning(f"{dst} exists, overwriting.")
+        else:
+            logging.warning(f"{dst} already exists, skipping.")
+            return None
+    try:
+        # Same directory, so a rename that replaces dst in one step
+        os.replace(src, dst)
+        logging.info(f"Renamed {fname} -> {new_name}")
+    except Exception as e:
+        logging.error(f"Failed to rename {fname}: {e}")
+        return None
+    if existing is not None:
+        existing.discard(fname)
+        existing.add(new_name)
+    return dst
+
+
 def rename_merged_files(id_map: dict, ext: str = '.xlsx', overwrite: bool = False, input_dir: str = 'merged'):
-    for fname in os.listdir(input_dir):
+    """
+    Rename every merged_<identifier> file in input_dir to its district name
+    (see rename_merged_file), from one os.scandir pass over the directory.
+    merge.merge_excels can write the district names directly instead.
+    """
+    with os.scandir(input_dir) as entries:
+        existing = {entry.name for entry in entries}
+    for fname in sorted(existing):
         if fname.lower().endswith(ext) and fname.startswith("merged_"):
-            identifier = fname[len("merged_"):].split('.')[0]
-            district = id_map.get(identifier)
-            if not district:
-                logging.warning(
-                    f"No district for identifier '{identifier}' in {fname}. Skipping.")
-                continue
-            new_name = f"{district}{ext}"
-            src = os.path.join(input_dir, fname)
-            dst = os.path.join(input_dir, new_name)
-            if os.path.exists(dst):
-                if overwrite:
-                    logging.warning(f"{dst} exists, overwriting.")
-                else:
-                    logging.warning(f"{dst} already exists, skipping.")
-                    continue
-            try:
-                shutil.move(src, dst)
-                logging.info(f"Renamed {fname} -> {new_name}")
-            except Exception as e:
-                logging.error(f"Failed to rename {fname}: {e}")
+            rename_merged_file(fname, id_map, ext, overwrite, input_dir, existing)
@@ -0,0 +1,163 @@
+"""
+Synthetic NVR registers for local benchmarks: PDFs laid out like the real
+registers (for the convert stage) or converted files as the convert stage
+writes them (to start the pipeline at transform), with no real voter data.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from table_io import stage_suffix, write_table_sheets
+
+SURNAMES = ["OKELLO", "AKELLO", "OPIO", "NAKATO", "MUGISHA", "ATIM", "OCHIENG", "NAMULI"]
+GIVEN_NAMES = ["JOHN", "GRACE", "PETER", "SARAH", "MOSES", "JOYCE", "DENIS", "AGNES"]
+VILLAGES = ["ABANYA", "BAROBIA", "ACHABA", "LOLWE", "AMWA"]
+TABLE_HEADER = ["PERNO", "SURNAME", "OTHER", "NAMES", "DOB", "SEX", "APPID", "VILLAGE", ""]
+
+# x positions (pt) of the TABLE_HEADER columns on a page. Every cell is a
+# single word at a fixed position, so pdfplumber's text strategy finds the
+# same columns on every page.
+PDF_COLUMNS = [40, 100, 160, 220, 290, 350, 380, 440, 500]
+
+
+def register_filename(identifier, constituency, sub_county, parish, station, seq, suffix=".pdf"):
+    """File name in the NVR_REGISTER_TXT_<id>_... form catalog.parse_register_name parses."""
+    return f"NVR_REGISTER_TXT_{identifier}_{constituency:03d}_{sub_county:02d}_{parish:02d}_{station:02d}_{seq}{suffix}"
+
+
+def header_lines(identifier, constituency, sub_county, parish, station):
+    """The register's header block, as repeated on every page."""
+    return [
+        "NATIONAL VOTERS REGISTER",
+        f"District : {identifier} DISTRICT{identifier} Parish : {parish:02d} PARISH{parish}",
+        f"Constituency : {constituency:03d} CONSTITUENCY{constituency} Polling Station : {station:02d} STATION{station}",
+        f"Sub-County : {sub_county:02d} SUBCOUNTY{sub_county}",
+    ]
+
+
+def register_rows(rng, n, first_perno, bad_ratio=0.0):
+    """
+    n voter rows of TABLE_HEADER's columns (all text, '' for empty cells),
+    a bad_ratio share of them malformed so the final stage has rows to reject.
+    """
+    rows = []
+    for i in range(n):
+        dob = f"{rng.integers(1, 29):02d}/{rng.integers(1, 13):02d}/{rng.integers(1940, 2006)}"
+        row = [str(first_perno + i), str(rng.choice(SURNAMES)), str(rng.choice(GIVEN_NAMES)),
+               str(rng.choice(GIVEN_NAMES)) if rng.random() < 0.5 else "", dob, str(rng.choice(["M", "F"])),
+               str(rng.integers(1_000_000, 9_999_999)), str(rng.choice(VILLAGES)), "VILLAGE"]
+        if rng.random() < bad_ratio:
+            row[5] = "X"  # invalid gender
+        rows.append(row)
+    return rows
+
+
+def register_table(header, page, pages, rows):
+    """
+    One page as pdfplumber extracts it from write_pdf's layout: the first
+    line as column headers, then the header block, the page number, the
+    table header, the voter rows and the page footer.
+    """
+    def line(text):
+        return [text] + [""] * (len(TABLE_HEADER) - 1)
+
+    lines = [line(text) for text in header] + [line(f"Page {page} of {pages}"), TABLE_HEADER]
+    lines += rows + [line(f"Page {page} of {pages}")]
+    return pd.DataFrame(lines, columns=line("ELECTORAL COMMISSION"))
+
+
+def _pdf_page_lines(header, page, pages, rows):
+    # (x, text) runs per line, empty cells left out
+    lines = [[(40, "ELECTORAL COMMISSION")]] + [[(40, line)] for line in header]
+    lines.append([(40, f"Page {page} of {pages}")])
+    for cells in [TABLE_HEADER] + rows:
+        lines.append([(x, text) for x, text in zip(PDF_COLUMNS, cells) if text])
+    lines.append([(40, f"Page {page} of {pages}")])
+    return lines
+
+
+def write_pdf(path, pages):
+    """
+    Write a minimal PDF with one Helvetica text page per entry of pages,
+    each a list of lines of (x, text) runs, 12pt apart from the top.
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")
+    page_ids = []
+    for lines in pages:
+        content, y = ["BT /F1 8 Tf"], 800
+        for runs in lines:
+            for x, text in runs:
+                text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+                content.append(f"1 0 0 1 {x} {y} Tm ({text}) Tj")
+            y -= 12
+        content.append("ET")
+        stream = "\n".join(content).encode("latin-1")
+        contents = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {contents} 0 R >>".encode()))
+    kids = " ".join(f"{p} 0 R" for p in page_ids)
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+    catalog = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    Path(path).write_bytes(bytes(out))
+
+
+def generate_registers(output_dir, districts=3, files_per_district=4, pages=10, rows_per_page=40,
+                       bad_ratio=0.02, seed=0, kind="pdf", file_format=None):
+    """
+    Write districts x files_per_district synthetic registers to output_dir.
+
+    Parameters:
+    output_dir (str): Target directory (original/ for PDFs, converted/ otherwise)
+    pages (int): Pages per register
+    rows_per_page (int): Voter rows per page
+    bad_ratio (float): Share of malformed voter rows
+    seed (int): Random seed; the same arguments always give the same files
+    kind (str): "pdf" for register PDFs, "converted" for convert-stage output
+    file_format (str): Format of the converted files (see table_io.INTERMEDIATE_FORMAT)
+
+    Returns:
+    list: Paths of the written files
+    """
+    if kind not in ("pdf", "converted"):
+        raise ValueError(f"Unknown kind '{kind}', expected 'pdf' or 'converted'")
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths, perno = [], 10_000_000
+    for d in range(districts):
+        identifier = str(20 + d)
+        for f in range(files_per_district):
+            place = (d + 1, f % 3 + 1, f % 5 + 1, f + 1)  # constituency, sub county, parish, station
+            header = header_lines(identifier, *place)
+            tables = []
+            for page in range(1, pages + 1):
+                rows = register_rows(rng, rows_per_page, perno, bad_ratio)
+                perno += rows_per_page
+                tables.append((page, rows))
+            suffix = ".pdf" if kind == "pdf" else stage_suffix(file_format)
+            path = os.path.join(output_dir, register_filename(identifier, *place, seq=100 + f, suffix=suffix))
+            if kind == "pdf":
+                write_pdf(path, [_pdf_page_lines(header, page, pages, rows) for page, rows in tables])
+            else:
+                write_table_sheets((register_table(header, page, pages, rows) for page, rows in tables),
+                                   path, index=True, file_format=file_format)
+            paths.append(path)
+    return paths
@@ -0,0 +1,469 @@
+import json
+import logging
+import os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from openpyxl import Workbook, load_workbook
+from pandas.io.parsers import TextParser
+from openpyxl.utils import get_column_letter
+from dotenv import load_dotenv
+
+# The settings below can come from .env, whichever module is run first
+load_dotenv()
+
+# Excel writer used for every stage output: env EXCEL_WRITER_ENGINE (read at
+# write time, so .env and the worker processes' environment apply), else
+# WRITER_ENGINE:
+# "openpyxl"   - pandas ExcelWriter, builds the whole workbook in memory
+# "write_only" - openpyxl write-only workbook, rows are streamed to disk
+WRITER_ENGINE = "write_only"
+WRITER_ENGINES = ("openpyxl", "write_only")
+
+# File format of the converted/, transformed/ and final/ stage files: env
+# INTERMEDIATE_FORMAT (read when a stage file is named, read or written, so
+# .env applies), else INTERMEDIATE_FORMAT. merged/ is always .xlsx.
+# "xlsx"    - Excel workbooks, one sheet per extracted table
+# "parquet" - Parquet, all tables of a file stacked with a '__sheet__' column
+# "arrow"   - Arrow IPC (Feather v2), same layout as parquet
+INTERMEDIATE_FORMAT = "xlsx"
+FORMAT_SUFFIXES = {"xlsx": ".xlsx", "parquet": ".parquet", "arrow": ".arrow"}
+
+# Rows converted to Python objects at a time by the write-only engine
+WRITE_CHUNK_ROWS = 50_000
+
+# Rows sampled per frame when estimating column widths (None: all rows)
+WIDTH_SAMPLE_ROWS = 10_000
+
+# Data rows that fit on one Excel sheet under its header row
+EXCEL_MAX_ROWS = 1_048_575
+
+# Rows per DataFrame yielded by the chunked readers
+READ_CHUNK_ROWS = 50_000
+
+
+def _column_width(name, col: pd.Series) -> float:
+    """Longest cell or header text of one column + 2, as the cells' str() would print."""
+    longest = 0
+    values = col.dropna()
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Only the categories in use, not one string per row
+        values = pd.Series(values.cat.categories[values.cat.codes.unique()])
+    if len(values):
+        # Every cell is measured, numbers included: tabula's object columns
+        # mix numbers and text (callers pass a sample of long frames)
+        longest = values.astype(str).str.len().max()
+    return float(max(longest, len(str(name))) + 2)
+
+
+def _sample(df: pd.DataFrame, sample_rows: Optional[int]) -> pd.DataFrame:
+    # Evenly spaced rows, so every sheet of a stacked register is represented
+    if sample_rows and len(df) > sample_rows:
+        return df.iloc[np.linspace(0, len(df) - 1, sample_rows).astype(int)]
+    return df
+
+
+def estimate_column_widths(df: pd.DataFrame, index: bool = False,
+                           sample_rows: Optional[int] = WIDTH_SAMPLE_ROWS) -> List[float]:
+    """
+    Column widths (longest cell or header text + 2) for df's columns, in
+    sheet order, estimated from at most sample_rows rows (None: all rows).
+    """
+    df = _sample(df, sample_rows)
+    widths = [_column_width(name, col) for name, col in df.items()]
+    if index:
+        widths.insert(0, float(max(len(str(df.index.max())) if len(df) else 0, 1) + 2))
+    return widths
+
+
+def update_column_widths(widths: Dict, df: pd.DataFrame,
+                         sample_rows: Optional[int] = WIDTH_SAMPLE_ROWS) -> Dict:
+    """
+    Fold df's column widths into widths (column name -> width), so widths
+    can be collected sheet by sheet during cleaning instead of re-scanning
+    the combined frame afterwards.
+    """
+    for name, width in zip(df.columns, estimate_column_widths(df, sample_rows=sample_rows)):
+        widths[name] = max(widths.get(name, 0), width)
+    return widths
+
+
+def widths_for(df: pd.DataFrame, widths: Dict) -> List[float]:
+    """Widths collected with update_column_widths, in df's column order."""
+    return [widths.get(name, float(len(str(name)) + 2)) for name in df.columns]
+
+
+def _set_widths(worksheet, widths: Optional[List[float]]) -> None:
+    for col_num, width in enumerate(widths or [], 1):
+        if width:
+            worksheet.column_dimensions[get_column_letter(col_num)].width = width
+
+
+def _header(df: pd.DataFrame, index: bool) -> list:
+    header = [None if isinstance(c, float) and pd.isna(c) else c for c in df.columns]
+    return ([None] + header) if index else header
+
+
+def _cell_values(col: pd.Series) -> list:
+    # Plain Python values, None for missing cells; datetime columns holding
+    # only dates become dates, which Excel shows without a time
+    if pd.api.types.is_datetime64_dtype(col):
+        values = col.dropna()
+        if (values == values.dt.normalize()).all():
+            col = col.dt.date
+    return col.astype(object).where(col.notna(), None).tolist()
+
+
+def _rows(df: pd.DataFrame, index: bool):
+    """Yield df's rows as tuples of plain Python values, None for missing cells."""
+    for start in range(0, len(df), WRITE_CHUNK_ROWS):
+        chunk = df.iloc[start:start + WRITE_CHUNK_ROWS]
+        columns = [_cell_values(col) for _, col in chunk.items()]
+        if index:
+            columns.insert(0, chunk.index.tolist())
+        yield from zip(*columns)
+
+
+def write_excel_sheets(
+    sheets: Union[Dict[str, pd.DataFrame], Iterable[pd.DataFrame]],
+    path,
+    index: bool = False,
+    column_widths: Optional[Dict[str, List[float]]] = None,
+    engine: Optional[str] = None,
+) -> None:
+    """
+    Write each frame to its own sheet. `sheets` is either a dict of sheet
+    name -> frame or an iterable of frames named Sheet1, Sheet2, ... which
+    is consumed one frame at a time.
+
+    Parameters:
+    path: Output .xlsx path
+    index (bool): Write the frame index as the first column
+    column_widths (dict): Sheet name -> list of column widths (None: no sizing)
+    engine (str): One of WRITER_ENGINES, defaults to env EXCEL_WRITER_ENGINE or WRITER_ENGINE
+    """
+    engine = engine or os.getenv("EXCEL_WRITER_ENGINE") or WRITER_ENGINE
+    if engine not in WRITER_ENGINES:
+        raise ValueError(f"Unknown Excel writer engine '{engine}', expected one of {WRITER_ENGINES}")
+    items = sheets.items() if isinstance(sheets, dict) else (
+        (f"Sheet{i+1}", df) for i, df in enumerate(sheets))
+    column_widths = column_widths or {}
+
+    if engine == "openpyxl":
+        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+            for sheet_name, df in items:
+                df.to_excel(writer, sheet_name=sheet_name, index=index)
+                _set_widths(writer.sheets[sheet_name], column_widths.get(sheet_name))
+        return
+
+    wb = Workbook(write_only=True)
+    for sheet_name, df in items:
+        ws = wb.create_sheet(sheet_name)
+        # Write-only sheets only accept column dimensions before the first row
+        _set_widths(ws, column_widths.get(sheet_name))
+        ws.append(_header(df, index))
+        for row in _rows(df, index):
+            ws.append(row)
+    wb.save(path)
+
+
+def write_excel(
+    df: pd.DataFrame,
+    path,
+    row_limit: Optional[int] = None,
+    index: bool = False,
+    column_widths: Optional[List[float]] = None,
+    engine: Optional[str] = None,
+) -> int:
+    """
+    Write one frame to Sheet1, rolling over to Sheet2, Sheet3, ... every
+    row_limit rows (None: single sheet). Returns the number of sheets.
+    """
+    row_limit = row_limit or max(len(df), 1)
+    n_sheets = max((len(df) + row_limit - 1) // row_limit, 1)
+    sheets = (df.iloc[i * row_limit:(i + 1) * row_limit] for i in range(n_sheets))
+    widths = {f"Sheet{i+1}": column_widths for i in range(n_sheets)} if column_widths else None
+    write_excel_sheets(sheets, path, index=index, column_widths=widths, engine=engine)
+    return n_sheets
+
+
+def write_excel_stream(
+    frames: Iterable[pd.DataFrame],
+    path,
+    row_limit: int,
+    column_widths: Optional[List[float]] = None,
+) -> int:
+    """
+    Append the rows of each frame to a write-only workbook as the frames
+    arrive, rolling over to a new sheet (with the header repeated) every
+    row_limit rows. The header is taken from the first frame and later
+    frames must have the same columns. Only the current frame is held in
+    memory. Returns the number of rows written; nothing is saved if it is 0.
+    """
+    wb = Workbook(write_only=True)
+    ws, columns, sheet_rows, n_sheets, n_rows = None, None, row_limit, 0, 0
+    for df in frames:
+        if columns is None:
+            columns = _header(df, index=False)
+        for row in _rows(df, index=False):
+            if sheet_rows >= row_limit:
+                n_sheets += 1
+                ws = wb.create_sheet(f"Sheet{n_sheets}")
+                _set_widths(ws, column_widths)
+                ws.append(columns)
+                sheet_rows = 0
+            ws.append(row)
+            sheet_rows += 1
+        n_rows += len(df)
+    if n_rows:
+        wb.save(path)
+        logging.info(f"Saved to {path} with {n_sheets} sheet(s).")
+    return n_rows
+
+
+def _format(file_format: Optional[str]) -> str:
+    file_format = file_format or os.getenv("INTERMEDIATE_FORMAT") or INTERMEDIATE_FORMAT
+    if file_format not in FORMAT_SUFFIXES:
+        raise ValueError(f"Unknown intermediate format '{file_format}', expected one of {list(FORMAT_SUFFIXES)}")
+    return file_format
+
+
+def stage_suffix(file_format: Optional[str] = None) -> str:
+    """File suffix of stage files in file_format (default INTERMEDIATE_FORMAT)."""
+    return FORMAT_SUFFIXES[_format(file_format)]
+
+
+def _cell_text(value):
+    # Integral floats read back from Excel as ints, so they are written the same way
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _positional(df: pd.DataFrame) -> pd.DataFrame:
+    # Arrow needs unique string column names; the real header is kept in the file metadata
+    return df.set_axis([str(i) for i in range(df.shape[1])], axis=1).reset_index(drop=True)
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """df with mixed-type object columns as text, which Arrow needs and Excel does not."""
+    columns = {}
+    for name, col in df.items():
+        if pd.api.types.infer_dtype(col, skipna=True) in ("mixed", "mixed-integer"):
+            col = col.map(_cell_text, na_action="ignore").astype(object).where(col.notna(), None)
+        columns[name] = col
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _write_arrow(table: pa.Table, path, file_format: str, meta: Dict) -> None:
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b"table_io": json.dumps(meta, default=str).encode(),
+    })
+    if file_format == "parquet":
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path)
+
+
+def _read_arrow(path, file_format: str):
+    table = pq.read_table(path) if file_format == "parquet" else feather.read_table(path)
+    return table.to_pandas(), json.loads(table.schema.metadata[b"table_io"])
+
+
+def write_table_sheets(
+    sheets: Union[Dict[str, pd.DataFrame], Iterable[pd.DataFrame]],
+    path,
+    index: bool = False,
+    file_format: Optional[str] = None,
+) -> None:
+    """
+    Write a multi-table stage file (like write_excel_sheets). In the Arrow
+    formats the tables are stacked, padded to the widest one and tagged
+    with a '__sheet__' column; the sheet names and headers are kept in the
+    file metadata so read_table_sheets gives back the same frames.
+    """
+    file_format = _format(file_format)
+    if file_format == "xlsx":
+        write_excel_sheets(sheets, path, index=index)
+        return
+
+    items = sheets.items() if isinstance(sheets, dict) else (
+        (f"Sheet{i+1}", df) for i, df in enumerate(sheets))
+    frames, headers = [], {}
+    for sheet_name, df in items:
+        if index:
+            df = df.reset_index()
+        headers[sheet_name] = [None if isinstance(c, float) and pd.isna(c) else c for c in df.columns]
+        df = _positional(df)
+        df["__sheet__"] = sheet_name
+        frames.append(df)
+    width = max((len(h) for h in headers.values()), default=0)
+    stacked = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame({"__sheet__": []})
+    stacked = _arrow_safe(stacked.reindex(columns=[str(i) for i in range(width)] + ["__sheet__"]))
+    _write_arrow(pa.Table.from_pandas(stacked, preserve_index=False), path, file_format,
+                 {"sheets": list(headers), "headers": list(headers.values())})
+
+
+def read_table_sheets(path, file_format: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+    """Sheet name -> frame of a stage file, like pd.read_excel(sheet_name=None)."""
+    file_format = _format(file_format)
+    if file_format == "xlsx":
+        return pd.read_excel(path, engine="openpyxl", sheet_name=None)
+
+    stacked, meta = _read_arrow(path, file_format)
+    groups = dict(tuple(stacked.groupby("__sheet__", sort=False)))
+    sheets = {}
+    for sheet_name, header in zip(meta["sheets"], meta["headers"]):
+        df = groups.get(sheet_name, stacked.iloc[:0])
+        df = df.iloc[:, :len(header)].reset_index(drop=True)
+        df.columns = header
+        sheets[sheet_name] = df
+    return sheets
+
+
+def write_table(df: pd.DataFrame, path, file_format: Optional[str] = None,
+                column_widths: Optional[List[float]] = None) -> None:
+    """
+    Write a single-table stage file: one sheet for xlsx (sized with
+    column_widths), otherwise an Arrow file that keeps df's column names,
+    including duplicate or non-string ones, and dtypes.
+    """
+    file_format = _format(file_format)
+    if file_format == "xlsx":
+        write_excel(df, path, column_widths=column_widths)
+        return
+    _write_arrow(pa.Table.from_pandas(_arrow_safe(_positional(df)), preserve_index=False), path, file_format,
+                 {"header": [None if isinstance(c, float) and pd.isna(c) else c for c in df.columns]})
+
+
+def write_table_stream(frames: Iterable[pd.DataFrame], path, file_format: Optional[str] = None) -> int:
+    """
+    write_table for a table arriving as a sequence of frames with the same
+    columns and dtypes, holding only the current frame in memory: appended
+    to a write-only workbook for xlsx, written batch by batch otherwise.
+    Categorical columns are stored as plain values in the Arrow formats,
+    since each frame may have its own categories. Writes a header-only file
+    if there are no rows. Returns the number of rows written.
+    """
+    file_format = _format(file_format)
+    if file_format == "xlsx":
+        last = []
+
+        def remember(frames):
+            for df in frames:
+                last[:] = [df]
+                yield df
+
+        n_rows = write_excel_stream(remember(frames), path, row_limit=EXCEL_MAX_ROWS)
+        if not n_rows and last:
+            write_excel(last[0], path)
+        return n_rows
+
+    writer, n_rows = None, 0
+    try:
+        for df in frames:
+            table = pa.Table.from_pandas(_arrow_safe(_positional(df)), preserve_index=False)
+            table = table.cast(pa.schema([
+                pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f
+                for f in table.schema
+            ], metadata=table.schema.metadata))
+            if writer is None:
+                meta = {"header": [None if isinstance(c, float) and pd.isna(c) else c for c in df.columns]}
+                schema = table.schema.with_metadata({
+                    **(table.schema.metadata or {}),
+                    b"table_io": json.dumps(meta, default=str).encode(),
+                })
+                writer = (pq.ParquetWriter(path, schema) if file_format == "parquet"
+                          else pa.ipc.new_file(path, schema))
+            writer.write_table(table.cast(schema))
+            n_rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def read_table(path, file_format: Optional[str] = None) -> pd.DataFrame:
+    """Read a single-table stage file, header from the first row for xlsx."""
+    file_format = _format(file_format)
+    if file_format == "xlsx":
+        return pd.read_excel(path, engine="openpyxl")
+    df, meta = _read_arrow(path, file_format)
+    df.columns = meta["header"]
+    return df
+
+
+def _excel_cells(row, width: int) -> list:
+    # Cell values as pd.read_excel's openpyxl reader hands them to its parser
+    cells = ["" if v is None else int(v) if isinstance(v, float) and v.is_integer() else v for v in row]
+    return cells + [""] * (width - len(cells))
+
+
+def read_excel_chunks(path, chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Stream an .xlsx file as DataFrames of at most chunk_rows rows, reading
+    every sheet in order with its first row as the header (so the sheets a
+    rolled-over file was split into come back as one table). Rows are read
+    with openpyxl in read-only mode, so only the current chunk is held in
+    memory. Cells are parsed as pd.read_excel parses them and the index
+    continues across chunks and sheets.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    offset = 0
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            while True:
+                batch = list(islice(rows, chunk_rows))
+                if not batch:
+                    break
+                # Rows of write-only workbooks can be ragged; pad them (and the
+                # header) to the chunk's widest row as pd.read_excel does for the
+                # sheet, then parse the values with the same TextParser
+                width = max(len(header), *(len(row) for row in batch))
+                data = [_excel_cells(row, width) for row in [header] + batch]
+                df = TextParser(data, header=0).read()
+                if len(df):
+                    df.index = range(offset, offset + len(df))
+                    offset += len(df)
+                    yield df
+    finally:
+        wb.close()
+
+
+def read_table_chunks(path, file_format: Optional[str] = None,
+                      chunk_rows: int = READ_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    read_table in chunks of at most chunk_rows rows, with the index
+    continuing across chunks: read_excel_chunks for xlsx, record batches of
+    the Parquet file or slices of the memory-mapped Arrow file otherwise.
+    """
+    file_format = _format(file_format)
+    if file_format == "xlsx":
+        yield from read_excel_chunks(path, chunk_rows)
+        return
+
+    if file_format == "parquet":
+        parquet_file = pq.ParquetFile(path)
+        meta = json.loads(parquet_file.schema_arrow.metadata[b"table_io"])
+        batches = parquet_file.iter_batches(batch_size=chunk_rows)
+    else:
+        table = feather.read_table(path, memory_map=True)
+        meta = json.loads(table.schema.metadata[b"table_io"])
+        batches = (table.slice(start, chunk_rows) for start in range(0, table.num_rows, chunk_rows))
+    offset = 0
+    for batch in batches:
+        df = batch.to_pandas()
+        df.columns = meta["header"]
+        df.index = range(offset, offset + len(df))
+        offset += len(df)
+        yield df
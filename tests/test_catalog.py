@@ -0,0 +1,32 @@
+import json
+
+from catalog import district_filename, load_district_map, parse_register_name, scan_registers, unique_districts
+
+
+def test_parse_register_name_components():
+    register = parse_register_name("final_transformed_NVR_REGISTER_TXT_76_004_01_02_03_123.xlsx", "final")
+    assert register.path == "final/final_transformed_NVR_REGISTER_TXT_76_004_01_02_03_123.xlsx"
+    assert (register.district, register.constituency, register.sub_county, register.parish,
+            register.polling_station, register.sequence) == ("76", "004", "01", "02", "03", "123")
+    assert parse_register_name("notes.xlsx") is None
+
+
+def test_scan_registers_filters_and_sorts(tmp_path):
+    for name in ["NVR_REGISTER_TXT_21_001_01_01_01_1.pdf", "NVR_REGISTER_TXT_20_001_01_01_01_1.pdf",
+                 "NVR_REGISTER_TXT_20_001_01_01_01_1.xlsx", "notes.pdf"]:
+        (tmp_path / name).write_bytes(b"")
+    assert [r.district for r in scan_registers(str(tmp_path), ".pdf")] == ["20", "21"]
+
+
+def test_unique_districts_drops_clashing_identifiers():
+    id_map = {"20": "OYAM", "21": "Oyam", "22": "GULU", "23": ""}
+    assert unique_districts(id_map) == {"22": "GULU", "23": ""}
+    names = {identifier: district_filename(identifier, unique_districts(id_map)) for identifier in id_map}
+    assert names == {"20": "merged_20.xlsx", "21": "merged_21.xlsx", "22": "GULU.xlsx", "23": "merged_23.xlsx"}
+
+
+def test_load_district_map_json_and_csv(tmp_path):
+    (tmp_path / "map.json").write_text(json.dumps({"20": "OYAM", "21": "OYAM", 22: " GULU "}))
+    assert load_district_map(str(tmp_path / "map.json")) == {"22": "GULU"}
+    (tmp_path / "map.csv").write_text("identifier,district\n20,OYAM\n22,GULU\n")
+    assert load_district_map(str(tmp_path / "map.csv")) == {"20": "OYAM", "22": "GULU"}
@@ -0,0 +1,104 @@
+import pandas as pd
+import pytest
+
+from consolidate import RECORD_COLUMNS, parse_record, parse_records, row_text, save_rejected_rows, typed_records
+
+# Transformed register rows as read back with header=None, skiprows=1:
+# serial, index, then the row's cells
+ROWS = [
+    [1, 6, "10000001", None, "OKELLO", "JOHN", None, "01/02/1980", "M", "1234567", "ABANYA", "VILLAGE"],
+    [2, 7, "10000002", None, "AKELLO", "GRACE", "JOYCE", pd.Timestamp("1975-12-31"), "f", "2345678",
+     "BAR OBIA", None],
+    [3, 8, "A1000003", None, "OPIO", "PETER", None, "05/06/1990", "M", "3456789", "ACHABA", "VILLAGE"],
+    [4, 9, "01/02/1980", None, "NAKATO", "SARAH", None, None, "F", "4567890", "LOLWE", "VILLAGE"],
+    [5, 10, "10000005", None, "01/02/1980", "MOSES", None, None, "M", "5678901", "AMWA", "VILLAGE"],
+    [6, 11, "10000006", None, "ATIM", "JOYCE", None, "07/08/1960", "X", "6789012", "ABANYA", "VILLAGE"],
+    [7, 12, "10000007", None, "OCHIENG", "DENIS", "JOHN", "09/10/1970", "M", "7890123", None, None],
+    [8, 13, "10000008", None, "NAMULI", None, None, "11/12/2000", "F", None, None, None],
+    [None] * 12,
+    [10, 15, "10000010", None, "MUGISHA", "AGNES", None, "31/02/1985", "F", "8901234", "LOLWE", None],
+    [11, 16, "12\u00b2", None, "OKELLO", "JOHN", None, "01/02/1980", "M", "1234567", "ABANYA", None],
+    [12, 17, "123456789012345678901", None, "OKELLO", "JOHN", None, "01/02/1980", "M", "1234567", "ABANYA", None],
+]
+
+
+def _frame():
+    return pd.DataFrame(ROWS, columns=range(12), dtype=object)
+
+
+def _rowwise(df):
+    # parse_record over each non-empty row: (records, {row index: reason})
+    records, reasons = [], {}
+    for index, row in df.dropna(how='all').drop(columns=[0, 1]).iterrows():
+        try:
+            records.append(parse_record(row_text(row)))
+        except ValueError as e:
+            reasons[index] = str(e)
+    return pd.DataFrame(records), reasons
+
+
+def test_parse_records_matches_parse_record():
+    df = _frame()
+    expected, _ = _rowwise(df)
+    actual = parse_records(df)
+    assert len(actual) == 3
+    pd.testing.assert_frame_equal(actual, typed_records(expected[actual.columns]))
+
+
+def test_rejected_rows_match_parse_record_reasons():
+    df = _frame()
+    _, reasons = _rowwise(df)
+    error_log = []
+    parse_records(df, error_log, "transformed_NVR_REGISTER_TXT_76_004_01_01_01_1.xlsx")
+    rejected = pd.concat(error_log, ignore_index=True)
+    assert dict(zip(rejected['row_index'], rejected['reason'])) == reasons
+    assert set(rejected['source_file']) == {"transformed_NVR_REGISTER_TXT_76_004_01_01_01_1.xlsx"}
+
+
+@pytest.mark.parametrize("index, reason", [
+    (2, "Invalid Voter ID format"),
+    (3, "Date not found in expected position"),
+    (4, "Date not found in expected position"),
+    (5, "Invalid gender"),
+    (6, "Missing components after date"),
+    (7, "Only 4 components found"),
+    (10, "Invalid Voter ID format"),
+    (11, "Invalid Voter ID format"),
+])
+def test_rejection_kinds(index, reason):
+    error_log = []
+    parse_records(_frame(), error_log)
+    rejected = pd.concat(error_log, ignore_index=True).set_index('row_index')
+    assert rejected.loc[index, 'reason'].startswith(reason)
+
+
+def test_invalid_date_of_birth_is_kept_as_missing():
+    records = parse_records(_frame())
+    assert records.loc[records['perno'] == 10000010, 'dob'].isna().all()
+
+
+def test_typed_records_stores_invalid_voter_ids_as_missing():
+    df = pd.DataFrame({name: ['M'] * 4 for name in RECORD_COLUMNS})
+    df['perno'] = ['10000001', '12\u00b2', '123456789012345678901', '123456789012345678']
+    assert typed_records(df)['perno'].tolist() == [10000001, pd.NA, pd.NA, 123456789012345678]
+
+
+def _rejected(source_file, reasons):
+    return pd.DataFrame({'source_file': source_file, 'row_index': range(len(reasons)),
+                         'raw_text': ['1 2 3'] * len(reasons), 'reason': reasons})
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_save_rejected_rows_replaces_only_reprocessed_sources(tmp_path, suffix):
+    path = tmp_path / f"rejected{suffix}"
+    assert save_rejected_rows([_rejected("a.xlsx", ["x", "y"]), _rejected("b.xlsx", ["z"])], path) == 3
+
+    # An incremental run that reprocessed b.xlsx (now without rejects) and c.xlsx
+    assert save_rejected_rows([_rejected("c.xlsx", [""])], path, replaced_sources=["b.xlsx", "c.xlsx"]) == 1
+    saved = pd.read_parquet(path) if suffix == ".parquet" else pd.read_csv(path, keep_default_na=False)
+    assert list(zip(saved['source_file'], saved['reason'])) == [("a.xlsx", "x"), ("a.xlsx", "y"), ("c.xlsx", "")]
+
+    # Without replaced_sources the file is overwritten
+    save_rejected_rows([_rejected("d.xlsx", ["w"])], path)
+    saved = pd.read_parquet(path) if suffix == ".parquet" else pd.read_csv(path)
+    assert list(saved['source_file']) == ["d.xlsx"]
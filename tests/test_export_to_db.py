@@ -0,0 +1,116 @@
+from contextlib import contextmanager
+
+import pandas as pd
+
+from consolidate import typed_records
+from export_to_db import _staging_name, copy_dataframe, create_table_sql, load_frames
+
+
+class FakeCursor:
+    def __init__(self, copies):
+        self.copies = copies
+
+    def copy_expert(self, sql, buffer):
+        self.copies.append((sql, buffer.read()))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stand-in for a SQLAlchemy connection on psycopg2, recording the SQL it is given."""
+
+    def __init__(self, exists=False):
+        self.exists = exists
+        self.statements, self.copies = [], []
+        self.connection = self
+
+    def execute(self, statement, params=None):
+        return self
+
+    def scalar(self):
+        return self.exists
+
+    def exec_driver_sql(self, sql):
+        self.statements.append(sql)
+        if sql.startswith("CREATE TABLE"):
+            self.exists = True
+
+    def cursor(self):
+        return FakeCursor(self.copies)
+
+
+def _records():
+    df = typed_records(pd.DataFrame({
+        'perno': ['10000001', '10000002'],
+        'surname': ['OKELLO', 'AKELLO'],
+        'othernames': ['JOHN', None],
+        'dob': ['01-02-1980', '31-02-1985'],
+        'sex': ['M', 'F'],
+        'appid_receipt_no': ['1234567', '2345678'],
+        'village': ['ABANYA VILLAGE', 'BAR OBIA'],
+    }))
+    # As export_excel_file prepares them
+    df['dob'] = df['dob'].dt.date
+    df['serialno'] = range(1, 3)
+    return df
+
+
+def test_create_table_sql_types():
+    sql = create_table_sql(_records(), "pdf_to_excel_data", "oyam")
+    assert sql.startswith('CREATE TABLE "pdf_to_excel_data"."oyam" (')
+    for column in ['"perno" BIGINT', '"surname" TEXT', '"othernames" TEXT', '"dob" DATE', '"sex" TEXT',
+                   '"appid_receipt_no" TEXT', '"village" TEXT', '"serialno" BIGINT']:
+        assert column in sql
+
+
+def test_copy_dataframe_replaces_table_and_streams_csv():
+    conn = FakeConnection(exists=True)
+    copy_dataframe(conn, _records(), "pdf_to_excel_data", "oyam", if_exists="replace", chunk_rows=1)
+
+    assert conn.statements[0] == 'DROP TABLE "pdf_to_excel_data"."oyam"'
+    assert conn.statements[1].startswith('CREATE TABLE "pdf_to_excel_data"."oyam"')
+    sql = {sql for sql, _ in conn.copies}
+    assert sql == {'COPY "pdf_to_excel_data"."oyam" ("perno", "surname", "othernames", "dob", "sex", '
+                   '"appid_receipt_no", "village", "serialno") FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'}
+    # One chunk per row, missing values as \N
+    assert [data for _, data in conn.copies] == [
+        "10000001,OKELLO,JOHN,1980-02-01,M,1234567,ABANYA VILLAGE,1\n",
+        "10000002,AKELLO,\\N,\\N,F,2345678,BAR OBIA,2\n",
+    ]
+
+
+def test_copy_dataframe_appends_without_ddl():
+    conn = FakeConnection(exists=True)
+    copy_dataframe(conn, _records(), "pdf_to_excel_data", "oyam", if_exists="append")
+    assert conn.statements == []
+    assert len(conn.copies) == 1
+
+
+def test_staging_names_of_long_tables_differ():
+    prefix = "x" * 60
+    first, second = _staging_name(prefix + "_a"), _staging_name(prefix + "_b")
+    assert first != second
+    assert len(first.encode()) <= 63 and first.endswith("__staging")
+
+
+class FakeEngine:
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def begin(self):
+        yield self.conn
+
+
+def test_load_frames_widens_columns_whose_type_changes_between_chunks():
+    conn = FakeConnection()
+    frames = [
+        pd.DataFrame({"note": [1, 2], "count": [1, 2]}),
+        pd.DataFrame({"note": ["late", None], "count": [3.0, None]}),
+    ]
+    assert load_frames(FakeEngine(conn), frames, "s", "t", loader="copy") == 4
+    assert '"note" BIGINT' in conn.statements[0]
+    assert conn.statements[1:] == ['ALTER TABLE "s"."t" ALTER COLUMN "note" TYPE TEXT USING "note"::text']
+    # Whole numbers with a missing value stay integers in the BIGINT column
+    assert [data for _, data in conn.copies] == ["1,1\n2,2\n", "late,3\n\\N,\\N\n"]
@@ -0,0 +1,25 @@
+import resource
+import sys
+
+import pytest
+
+import instrumentation
+from instrumentation import reset_run, run_report, stage, track
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="resets the peak RSS through /proc")
+def test_file_peak_rss_is_per_file():
+    reset_run()
+    with stage("final"):
+        with track("final", "big.xlsx"):
+            buffer = bytearray(300 * 1024 * 1024)
+            buffer[::4096] = b"x" * len(buffer[::4096])  # touch every page
+            del buffer
+        with track("final", "small.xlsx"):
+            pass
+    big, small = run_report()["files"]
+    stage_entry = run_report()["stages"][0]
+    assert big["peak_rss_mb"] > small["peak_rss_mb"] + 200
+    # The stage still reports the peak of the whole process
+    assert stage_entry["peak_rss_mb"] >= big["peak_rss_mb"]
+    assert instrumentation._peak_rss_mb() * 1024 >= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
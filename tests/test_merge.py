@@ -0,0 +1,59 @@
+import os
+
+import pandas as pd
+import pytest
+
+from consolidate import typed_records
+from manifest import open_manifest, recorded
+from merge import merge_excels
+from table_io import write_table
+
+
+def _records(first_perno):
+    return typed_records(pd.DataFrame({
+        'perno': [str(first_perno), str(first_perno + 1)],
+        'surname': ['OKELLO', 'AKELLO'],
+        'othernames': ['JOHN', ''],
+        'dob': ['01-02-1980', '03-04-1975'],
+        'sex': ['M', 'F'],
+        'appid_receipt_no': ['1234567', '2345678'],
+        'village': ['ABANYA', 'LOLWE'],
+    }))
+
+
+@pytest.fixture
+def final_dir(tmp_path):
+    final = tmp_path / "final"
+    final.mkdir()
+    write_table(_records(10000001), final / "final_transformed_NVR_REGISTER_TXT_20_001_01_01_01_100.xlsx", "xlsx")
+    (final / "final_transformed_NVR_REGISTER_TXT_20_001_01_01_01_101.xlsx").write_bytes(b"not a workbook")
+    return final
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_group_with_unreadable_member_is_not_recorded(tmp_path, final_dir, streaming):
+    state_db = str(tmp_path / "state.sqlite")
+    merged = tmp_path / "merged"
+    merge_excels(str(final_dir), str(merged), streaming=streaming, state_db=state_db, file_format="xlsx")
+    assert os.listdir(merged) == ["merged_20.xlsx"]
+    with open_manifest(state_db) as conn:
+        assert "20" not in recorded(conn, "merge")
+
+    # Once the member is readable again the group is merged and recorded
+    write_table(_records(10000003), final_dir / "final_transformed_NVR_REGISTER_TXT_20_001_01_01_01_101.xlsx",
+                "xlsx")
+    merge_excels(str(final_dir), str(merged), streaming=streaming, state_db=state_db, file_format="xlsx")
+    assert len(pd.read_excel(merged / "merged_20.xlsx")) == 4
+    with open_manifest(state_db) as conn:
+        assert "20" in recorded(conn, "merge")
+
+
+def test_identifiers_sharing_a_district_keep_their_own_files(tmp_path):
+    final = tmp_path / "final"
+    final.mkdir()
+    for district, perno in [("20", 10000001), ("21", 10000003), ("22", 10000005)]:
+        write_table(_records(perno), final / f"final_transformed_NVR_REGISTER_TXT_{district}_001_01_01_01_100.xlsx",
+                    "xlsx")
+    merged = tmp_path / "merged"
+    merge_excels(str(final), str(merged), file_format="xlsx", id_map={"20": "OYAM", "21": "OYAM", "22": "GULU"})
+    assert sorted(os.listdir(merged)) == ["GULU.xlsx", "merged_20.xlsx", "merged_21.xlsx"]
@@ -0,0 +1,50 @@
+import pandas as pd
+
+import pdftoexcel
+from table_io import read_table_sheets
+
+
+def _shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdftoexcel, "page_count", lambda path: 25 if path == "long.pdf" else 3)
+    jobs = [
+        ("short.pdf", ("short.pdf", str(tmp_path / "short.xlsx"), "pdfplumber", "xlsx")),
+        ("long.pdf", ("long.pdf", str(tmp_path / "long.xlsx"), "pdfplumber", "xlsx")),
+    ]
+    return pdftoexcel._shard_jobs(jobs, 10)
+
+
+def _result(key, status="ok", value=None, error=None):
+    return {"key": key, "status": status, "elapsed": 1.0, "error": error, "value": value}
+
+
+def test_shards_are_reassembled_in_page_order(tmp_path, monkeypatch):
+    jobs, shards = _shards(tmp_path, monkeypatch)
+    keys = [key for key, _ in jobs]
+    assert keys == ["long.pdf [pages 1-10]", "long.pdf [pages 11-20]", "long.pdf [pages 21-25]", "short.pdf"]
+    assert [args[-1] for _, args in jobs[:3]] == [(1, 10), (11, 20), (21, 25)]
+
+    # The shards finish out of order, with the short PDF in between
+    pages = {key: [pd.DataFrame({"page": [i]}) for i in range(args[-1][0], args[-1][1] + 1)] for key, args in jobs[:3]}
+    runner = [_result(keys[2], value=pages[keys[2]]), _result(keys[0], value=pages[keys[0]]),
+              _result("short.pdf", value=str(tmp_path / "short.xlsx")), _result(keys[1], value=pages[keys[1]])]
+    results = list(pdftoexcel._reassemble(iter(runner), shards, "xlsx"))
+
+    assert [(r["key"], r["status"]) for r in results] == [("short.pdf", "ok"), ("long.pdf", "ok")]
+    assert results[1]["elapsed"] == 3.0
+    sheets = read_table_sheets(tmp_path / "long.xlsx", file_format="xlsx")
+    assert list(sheets) == [f"Sheet{i}" for i in range(1, 26)]
+    assert [df["page"].item() for df in sheets.values()] == list(range(1, 26))
+
+
+def test_a_failed_shard_fails_the_whole_pdf(tmp_path, monkeypatch):
+    jobs, shards = _shards(tmp_path, monkeypatch)
+    keys = [key for key, _ in jobs]
+    runner = [_result(keys[1], value=[pd.DataFrame({"page": [11]})]),
+              _result(keys[0], status="timeout", error="Timed out after 60s"),
+              _result(keys[2], value=[pd.DataFrame({"page": [21]})])]
+    results = list(pdftoexcel._reassemble(iter(runner), shards, "xlsx"))
+
+    assert len(results) == 1
+    assert results[0]["key"] == "long.pdf" and results[0]["status"] == "timeout"
+    assert "pages 1-10" in results[0]["error"]
+    assert not (tmp_path / "long.xlsx").exists()
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+import pipeline
+from consolidate import typed_records
+
+
+def _process_pdf(pdf_path, extractor, debug_dir):
+    records = typed_records(pd.DataFrame({
+        'perno': ['10000001'], 'surname': ['OKELLO'], 'othernames': ['JOHN'], 'dob': ['01-02-1980'],
+        'sex': ['M'], 'appid_receipt_no': ['1234567'], 'village': ['ABANYA'],
+    }))
+    return records, []
+
+
+def _export_excel_file(engine, path, schema, if_exists, loader, atomic_swap):
+    return {"table": "t", "rows": 1, "seconds": 0.1, "rows_per_sec": 10.0}
+
+
+def _locked(*args, **kwargs):
+    raise sqlite3.OperationalError("database is locked")
+
+
+def test_overlapped_run_survives_manifest_errors(tmp_path, monkeypatch):
+    original = tmp_path / "original"
+    original.mkdir()
+    for district in range(20, 26):
+        (original / f"NVR_REGISTER_TXT_{district}_001_01_01_01_100.pdf").write_bytes(b"%PDF")
+    monkeypatch.setattr(pipeline, "process_pdf", _process_pdf)
+    monkeypatch.setattr(pipeline, "export_excel_file", _export_excel_file)
+    monkeypatch.setattr(pipeline, "record", _locked)
+
+    results = {}
+    run = threading.Thread(target=lambda: results.update(pipeline.run_overlapped(
+        str(original), str(tmp_path / "merged"), extractor="pdfplumber", rejected_path=None,
+        state_db=str(tmp_path / "state.sqlite"), engine=object(), queue_size=1)), daemon=True)
+    run.start()
+    run.join(timeout=60)
+    assert not run.is_alive(), "run_overlapped hung after a manifest error"
+    assert len(results["merged"]) == 6
+    assert len(results["exported"]) == 6
+
+
+def test_overlapped_run_does_not_export_incomplete_groups(tmp_path, monkeypatch):
+    original = tmp_path / "original"
+    original.mkdir()
+    for name in ["NVR_REGISTER_TXT_20_001_01_01_01_100.pdf", "NVR_REGISTER_TXT_20_001_01_01_01_101.pdf",
+                 "NVR_REGISTER_TXT_21_001_01_01_01_100.pdf"]:
+        (original / name).write_bytes(b"%PDF")
+
+    def process_pdf(pdf_path, extractor, debug_dir):
+        if pdf_path.endswith("_101.pdf"):
+            raise ValueError("unreadable PDF")
+        return _process_pdf(pdf_path, extractor, debug_dir)
+
+    exported = []
+    monkeypatch.setattr(pipeline, "process_pdf", process_pdf)
+    monkeypatch.setattr(pipeline, "export_excel_file",
+                        lambda engine, path, *args: exported.append(path) or _export_excel_file(engine, path, *args))
+    result = pipeline.run_overlapped(str(original), str(tmp_path / "merged"), extractor="pdfplumber",
+                                     rejected_path=None, engine=object())
+    assert sorted(os.path.basename(path) for path in result["merged"]) == ["merged_20.xlsx", "merged_21.xlsx"]
+    assert [os.path.basename(path) for path in exported] == ["merged_21.xlsx"]
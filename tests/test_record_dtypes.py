@@ -0,0 +1,49 @@
+import datetime
+
+import pandas as pd
+
+from consolidate import RECORD_DTYPES, typed_records
+from export_to_db import export_chunks
+from merge import merge_frames, save_dataframe_to_excel
+
+
+def _records(perno, villages):
+    # Two voter records, as parse_records returns them
+    return typed_records(pd.DataFrame({
+        'perno': [str(perno), str(perno + 1)],
+        'surname': ['OKELLO', 'AKELLO'],
+        'othernames': ['JOHN', 'GRACE'],
+        'dob': ['01-02-1980', '01-02-1980'],
+        'sex': ['M', 'F'],
+        'appid_receipt_no': ['1234567', '2345678'],
+        'village': villages,
+    }))
+
+
+def test_merge_frames_keeps_record_dtypes():
+    merged = merge_frames({
+        "final_transformed_NVR_REGISTER_TXT_20_001_01_01_01_100.xlsx": _records(10000001, ['ABANYA', 'LOLWE']),
+        "final_transformed_NVR_REGISTER_TXT_20_001_01_01_01_101.xlsx": _records(10000003, ['AMWA', 'AMWA']),
+    })
+    assert len(merged) == 4
+    for name, dtype in RECORD_DTYPES.items():
+        if name != 'village':
+            assert merged[name].dtype == dtype, name
+    # The villages' categories are the union of the frames'
+    assert isinstance(merged['village'].dtype, pd.CategoricalDtype)
+    assert set(merged['village'].cat.categories) == {'ABANYA', 'LOLWE', 'AMWA'}
+    assert isinstance(merged['__sourcefile__'].dtype, pd.CategoricalDtype)
+    assert merged['__sourcefile__'].cat.categories.size == 2
+
+
+def test_export_chunks_type_records_with_dates_of_birth(tmp_path):
+    path = tmp_path / "OYAM.xlsx"
+    save_dataframe_to_excel(merge_frames({"a.xlsx": _records(10000001, ['ABANYA', 'LOLWE'])}), str(path))
+    imported = datetime.datetime(2026, 1, 1)
+    chunks = list(export_chunks(str(path), imported, chunk_rows=1))
+    assert [len(df) for df in chunks] == [1, 1]
+    df = pd.concat(chunks, ignore_index=True)
+    assert df['perno'].dtype == 'Int64'
+    assert df['dob'].tolist() == [datetime.date(1980, 2, 1)] * 2
+    assert df['serialno'].tolist() == [1, 2]
+    assert (df['date_imported'] == imported).all()
@@ -0,0 +1,119 @@
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+from table_io import (
+    estimate_column_widths, read_table, read_table_chunks, read_table_sheets, stage_suffix, write_excel,
+    write_table, write_table_sheets, write_table_stream,
+)
+
+ARROW_FORMATS = ["parquet", "arrow"]
+
+
+def test_writer_engine_is_read_from_the_environment_at_write_time(tmp_path, monkeypatch):
+    df = pd.DataFrame({"a": [1, 2]})
+    monkeypatch.setenv("EXCEL_WRITER_ENGINE", "openpyxl")
+    write_excel(df, tmp_path / "a.xlsx")
+    assert pd.read_excel(tmp_path / "a.xlsx")["a"].tolist() == [1, 2]
+
+    monkeypatch.setenv("EXCEL_WRITER_ENGINE", "xlsxwriter")
+    with pytest.raises(ValueError, match="xlsxwriter"):
+        write_excel(df, tmp_path / "b.xlsx")
+
+
+def test_intermediate_format_is_read_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("INTERMEDIATE_FORMAT", "parquet")
+    assert stage_suffix() == ".parquet"
+    path = tmp_path / f"final{stage_suffix()}"
+    write_table(pd.DataFrame({"a": [1, 2]}), path)
+    assert pq.read_table(path).num_rows == 2
+    assert read_table(path)["a"].tolist() == [1, 2]
+
+    monkeypatch.delenv("INTERMEDIATE_FORMAT")
+    assert stage_suffix() == ".xlsx"
+
+
+def test_column_widths_measure_mixed_and_numeric_columns():
+    df = pd.DataFrame({
+        "a": pd.Series([12345678901234567890, "NVR REGISTER", None], dtype=object),
+        "b": [1.5, 123456.25, None],
+        "c": [7, 1234567, 3],
+        "d": pd.Categorical(["OYAM", "KOLE", "OYAM"]),
+        "long header": ["x", "y", "z"],
+    })
+    assert estimate_column_widths(df) == [22.0, 11.0, 9.0, 6.0, 13.0]
+
+
+def _register(start, n):
+    # A converted register page: duplicate and blank headers, a mixed object column
+    return pd.DataFrame(
+        [[i, "NVR REGISTER" if i % 3 == 0 else 1000 + i, f"NAME {i}", 1.5 * i] for i in range(start, start + n)],
+        columns=["No", "Voter", "Name", "No"],
+    ).assign(**{"": None})
+
+
+@pytest.mark.parametrize("file_format", ARROW_FORMATS)
+def test_table_round_trip_keeps_header_and_values(tmp_path, file_format):
+    df = _register(0, 7)
+    path = tmp_path / f"t{stage_suffix(file_format)}"
+    write_table(df, path, file_format=file_format)
+    back = read_table(path, file_format=file_format)
+
+    assert list(back.columns) == ["No", "Voter", "Name", "No", ""]
+    # Mixed numbers and text come back as text, like the cells of an xlsx stage file
+    assert back.iloc[:, 1].tolist() == ["NVR REGISTER", "1001", "1002", "NVR REGISTER", "1004", "1005", "NVR REGISTER"]
+    assert back["Name"].tolist() == df["Name"].tolist()
+    assert back.iloc[:, 3].tolist() == df.iloc[:, 3].tolist()
+
+
+@pytest.mark.parametrize("file_format", ARROW_FORMATS)
+def test_stream_and_chunks_round_trip(tmp_path, file_format):
+    frames = [_register(0, 5), _register(5, 5), _register(10, 2)]
+    path = tmp_path / f"t{stage_suffix(file_format)}"
+    assert write_table_stream(iter(frames), path, file_format=file_format) == 12
+
+    chunks = list(read_table_chunks(path, file_format=file_format, chunk_rows=4))
+    assert [len(c) for c in chunks] == [4, 4, 4]
+    assert list(chunks[-1].index) == [8, 9, 10, 11]
+    whole = pd.concat(chunks)
+    assert list(whole.columns) == ["No", "Voter", "Name", "No", ""]
+    assert whole.iloc[:, 0].tolist() == list(range(12))
+    assert whole.equals(read_table(path, file_format=file_format))
+
+
+@pytest.mark.parametrize("file_format", ARROW_FORMATS)
+def test_sheets_are_stacked_and_split_back(tmp_path, file_format):
+    sheets = {
+        "Sheet1": pd.DataFrame({"No": [1, 2], "Name": ["A", "B"], "Village": ["X", "Y"]}),
+        "Empty": pd.DataFrame({"No": [], "Name": []}),
+        "Sheet3": pd.DataFrame({"Page": [3]}),
+    }
+    path = tmp_path / f"t{stage_suffix(file_format)}"
+    write_table_sheets(sheets, path, file_format=file_format)
+
+    # One stacked table, as wide as the widest sheet and tagged with its sheet
+    raw = pq.read_table(path) if file_format == "parquet" else feather.read_table(path)
+    assert raw.column_names == ["0", "1", "2", "__sheet__"]
+    assert raw["__sheet__"].to_pylist() == ["Sheet1", "Sheet1", "Sheet3"]
+
+    back = read_table_sheets(path, file_format=file_format)
+    assert list(back) == ["Sheet1", "Empty", "Sheet3"]
+    assert list(back["Sheet1"].columns) == ["No", "Name", "Village"]
+    assert back["Sheet1"].values.tolist() == [[1, "A", "X"], [2, "B", "Y"]]
+    assert list(back["Empty"].columns) == ["No", "Name"] and back["Empty"].empty
+    assert list(back["Sheet3"].columns) == ["Page"]
+    assert back["Sheet3"]["Page"].tolist() == [3]
+
+
+@pytest.mark.parametrize("file_format", ARROW_FORMATS)
+def test_empty_sheets_and_streams(tmp_path, file_format):
+    path = tmp_path / f"sheets{stage_suffix(file_format)}"
+    write_table_sheets({}, path, file_format=file_format)
+    assert read_table_sheets(path, file_format=file_format) == {}
+
+    path = tmp_path / f"empty{stage_suffix(file_format)}"
+    write_table(pd.DataFrame({"No": [], "Name": []}), path, file_format=file_format)
+    back = read_table(path, file_format=file_format)
+    assert list(back.columns) == ["No", "Name"] and back.empty
+    assert list(read_table_chunks(path, file_format=file_format)) == []
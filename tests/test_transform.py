@@ -0,0 +1,61 @@
+import pandas as pd
+
+from transform import row_filter_mask, strip_text
+
+HEADER = ["No", "Name", "Village"]
+# A stacked, not yet stripped register: voter rows, a page footer, blank
+# rows and the header row repeated by the next page
+ROWS = [
+    ["1", " OKELLO JOHN ", "ABANYA"],
+    [2, "AKELLO GRACE", " BAR OBIA"],
+    ["Page 1 of 2", None, None],
+    [None, None, None],
+    ["No", "Name", "Village"],
+    [" 3", "OPIO PETER", None],
+    [None, "Pagegate", None],
+    [4, None, 1.5],
+]
+
+
+def _frame():
+    return pd.DataFrame(ROWS, columns=HEADER, dtype=object)
+
+
+def _drop_rowwise(df):
+    # The row-wise filter clean_sheets used before row_filter_mask
+    df = df.dropna(how='all')
+    df = df.apply(lambda col: col.str.strip() if col.dtype == 'object' else col)
+    page_mask = df.apply(lambda row: row.astype(str).str.contains('Page').any(), axis=1)
+    return df[~page_mask]
+
+
+def test_strip_text_leaves_other_cells_alone():
+    stripped = strip_text(_frame())
+    assert stripped["No"].tolist()[:2] == ["1", 2]
+    assert stripped["Name"][0] == "OKELLO JOHN"
+    assert stripped["Village"][1] == "BAR OBIA"
+    assert stripped["Village"][7] == 1.5
+    assert stripped["No"][5] == "3"
+    assert list(stripped.columns) == HEADER
+
+
+def test_row_filter_mask_matches_the_rowwise_filter():
+    df = strip_text(_frame())
+    expected = _drop_rowwise(_frame())
+    # The row-wise filter kept repeated header rows; the mask drops them too
+    expected = expected[~(expected == HEADER).all(axis=1)]
+    actual = df[~row_filter_mask(df)]
+
+    assert list(actual.index) == list(expected.index) == [0, 1, 5, 7]
+    # The old strip turned numbers in text columns into NaN; strip_text keeps them
+    text = expected.notna()
+    assert actual[text].equals(expected[text])
+    assert actual.at[1, "No"] == 2 and actual.at[7, "Village"] == 1.5
+
+
+def test_row_filter_mask_options():
+    df = strip_text(_frame())
+    assert list(row_filter_mask(df, patterns={}, drop_blank=False, drop_header=False)) == [False] * len(ROWS)
+    assert row_filter_mask(df, patterns={}).tolist() == [False, False, False, True, True, False, False, False]
+    custom = row_filter_mask(df, patterns={"village": r"^ABANYA$"}, drop_blank=False, drop_header=False)
+    assert custom.tolist() == [True] + [False] * (len(ROWS) - 1)
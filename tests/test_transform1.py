@@ -0,0 +1,44 @@
+import pandas as pd
+
+from transform1 import METADATA_FIELDS, extract_metadata, metadata_columns, parse_header_block
+
+BLOCK = (
+    "ELECTORAL COMMISSION",
+    "District : 76 OYAM Parish : 01 ABANYA",
+    "Constituency : 004 OYAM COUNTY NORTH Polling Station : 01 BAR OBIA",
+    "Sub-County : 01 ACHABA",
+)
+OTHER = (
+    "District : 76 OYAM Parish : 02 AMWA",
+    "Constituency : 004 OYAM COUNTY NORTH Polling Station : 02 LOLWE",
+)
+
+
+def test_parse_header_block_values():
+    assert parse_header_block(BLOCK) == ("76 OYAM", "01 ABANYA", "004 OYAM COUNTY NORTH", "01 BAR OBIA", "01 ACHABA")
+    assert parse_header_block(OTHER) == ("76 OYAM", "02 AMWA", "004 OYAM COUNTY NORTH", "02 LOLWE", None)
+    assert parse_header_block(("ELECTORAL COMMISSION", "")) == (None,) * len(METADATA_FIELDS)
+    assert extract_metadata(list(BLOCK))["polling_station"] == "01 BAR OBIA"
+
+
+def test_parse_header_block_is_cached():
+    parse_header_block.cache_clear()
+    for _ in range(3):
+        parse_header_block(BLOCK)
+    info = parse_header_block.cache_info()
+    assert (info.misses, info.hits) == (1, 2)
+
+
+def test_metadata_columns_are_categoricals_repeated_per_sheet():
+    sheets = [parse_header_block(BLOCK), parse_header_block(OTHER), parse_header_block(BLOCK)]
+    columns = metadata_columns(sheets, [2, 1, 3])
+
+    assert list(columns) == METADATA_FIELDS
+    frame = pd.DataFrame(columns)
+    assert all(isinstance(dtype, pd.CategoricalDtype) for dtype in frame.dtypes)
+    assert frame["parish"].tolist() == ["01 ABANYA"] * 2 + ["02 AMWA"] + ["01 ABANYA"] * 3
+    assert list(frame["parish"].cat.categories) == ["01 ABANYA", "02 AMWA"]
+    assert list(frame["district"].cat.categories) == ["76 OYAM"]
+    # A field missing from a header block is a missing value, not a category
+    assert frame["sub_county"].isna().tolist() == [False] * 2 + [True] + [False] * 3
+    assert list(frame["sub_county"].cat.categories) == ["01 ACHABA"]
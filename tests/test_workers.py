@@ -0,0 +1,18 @@
+import time
+
+from workers import imap_jobs
+
+
+def test_finished_jobs_are_not_timed_out_by_a_slow_consumer():
+    # 'a' finishes well within the timeout, but while the caller spends
+    # longer than the timeout on the result of 'b'
+    statuses = {}
+    for result in imap_jobs(time.sleep, [("a", (0.3,)), ("b", (0,))], workers=2, timeout=1):
+        statuses[result["key"]] = result["status"]
+        time.sleep(1.5)
+    assert statuses == {"a": "ok", "b": "ok"}
+
+
+def test_slow_job_times_out():
+    results = list(imap_jobs(time.sleep, [("slow", (30,)), ("fast", (0,))], workers=1, timeout=1))
+    assert {r["key"]: r["status"] for r in results} == {"slow": "timeout", "fast": "ok"}
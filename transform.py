@@ -1,55 +1,155 @@
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from openpyxl.utils import get_column_letter  # Added missing import
+from instrumentation import file_size, track
+from manifest import changed_files, open_manifest, record
+from table_io import (WIDTH_SAMPLE_ROWS, read_table_sheets, stage_suffix, update_column_widths,
+                      widths_for, write_table)
 
-def transform_excels(input_dir="converted", output_dir="transformed"):
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
+# Rows dropped by clean_sheets when any cell matches one of these patterns
+# (regular expressions, searched in the cell text)
+ROW_FILTER_PATTERNS = {
+    "page_footer": r"Page",
+}
 
-    for excel_file in Path(input_dir).glob("*.xlsx"):
-        output_path = Path(output_dir) / f"transformed_{excel_file.name}"
+def strip_text(df):
+    """Strip surrounding whitespace from the text cells of df, leaving other cells as they are."""
+    columns = {}
+    for i, (_, col) in enumerate(df.items()):
+        if pd.api.types.infer_dtype(col, skipna=True) in ("string", "mixed", "mixed-integer"):
+            stripped = col.str.strip()
+            col = stripped.where(stripped.notna(), col)
+        columns[i] = col
+    return pd.DataFrame(columns, index=df.index).set_axis(df.columns, axis=1)
+
+def row_filter_mask(df, patterns=None, drop_blank=True, drop_header=True):
+    """
+    Boolean mask of the rows to drop, evaluated column by column over the
+    whole frame: rows with a cell matching any of `patterns` (name -> regex,
+    default ROW_FILTER_PATTERNS), rows with only empty cells and rows that
+    repeat the column headers.
+    """
+    patterns = ROW_FILTER_PATTERNS if patterns is None else patterns
+    regex = "|".join(f"(?:{p})" for p in patterns.values())
+    matched = np.zeros(len(df), dtype=bool)
+    blank = np.ones(len(df), dtype=bool)
+    header = np.ones(len(df), dtype=bool)
+    for i, (name, col) in enumerate(df.items()):
+        text = col.astype(str)
+        if regex:
+            matched |= text.str.contains(regex, na=False).to_numpy(dtype=bool)
+        if drop_blank:
+            blank &= (col.isna() | (text == "")).to_numpy(dtype=bool)
+        if drop_header:
+            header &= ((text == str(name)).fillna(False) | (col.isna() & pd.isna(name))).to_numpy(dtype=bool)
+    mask = matched
+    if drop_blank:
+        mask |= blank
+    if drop_header and df.shape[1]:
+        mask |= header
+    return mask
+
+def clean_sheets(all_sheets, widths=None, width_sample_rows=WIDTH_SAMPLE_ROWS, row_filters=None):
+    """
+    Clean the sheets of one converted register and stack them into a single
+    frame with a 'Serial No' column. Returns None if no sheet has data.
 
+    Parameters:
+    all_sheets (dict): Sheet name -> DataFrame, as read by table_io.read_table_sheets
+    widths (dict): If given, filled with column name -> display width while
+        cleaning (see table_io.update_column_widths)
+    width_sample_rows (int): Rows sampled for the widths (None: all)
+    row_filters (dict): Patterns of the rows to drop (see row_filter_mask),
+        defaults to ROW_FILTER_PATTERNS
+    """
+    processed_data = []
+
+    for sheet_name, df in all_sheets.items():
         try:
-            all_sheets = pd.read_excel(excel_file, engine='openpyxl', sheet_name=None)
-            processed_data = []
+            # Data cleaning process
+            df_clean = df.iloc[5:].reset_index(drop=True)
+            df_clean.columns = df_clean.iloc[0]
+            processed_data.append(df_clean.iloc[1:])
+
+        except Exception as e:
+            print(f"Sheet error in {sheet_name}: {str(e)}")
 
-            for sheet_name, df in all_sheets.items():
-                try:
-                    # Data cleaning process
-                    df_clean = df.iloc[5:].reset_index(drop=True)
-                    df_clean.columns = df_clean.iloc[0]
-                    df_clean = df_clean.iloc[1:].dropna(how='all')
+    if not processed_data:
+        return None
 
-                    # Fixed: Replace deprecated applymap with vectorized operation
-                    df_clean = df_clean.apply(lambda col: col.str.strip() if col.dtype == 'object' else col)
+    # Strip and filter all sheets in one pass over the stacked frame
+    combined_df = strip_text(pd.concat(processed_data, ignore_index=True))
 
-                    # Remove page rows
-                    page_mask = df_clean.apply(lambda row: row.astype(str).str.contains('Page').any(), axis=1)
-                    df_clean = df_clean[~page_mask]
+    # Remove page footers, blank rows and repeated headers
+    combined_df = combined_df[~row_filter_mask(combined_df, row_filters)].reset_index(drop=True)
+    if combined_df.empty:
+        return None
 
-                    if not df_clean.empty:
-                        processed_data.append(df_clean)
+    if widths is not None:
+        update_column_widths(widths, combined_df, width_sample_rows)
+    combined_df.insert(0, 'Serial No', range(1, len(combined_df)+1))
+    if widths is not None:
+        widths['Serial No'] = max(len(str(len(combined_df))), len('Serial No')) + 2
+    return combined_df
 
-                except Exception as e:
-                    print(f"Sheet error in {sheet_name}: {str(e)}")
+def save_transformed(combined_df, output_path, column_widths=None, file_format=None):
+    write_table(combined_df, output_path, file_format, column_widths=column_widths)
 
-            if processed_data:
-                combined_df = pd.concat(processed_data, ignore_index=True)
-                combined_df.insert(0, 'Serial No', range(1, len(combined_df)+1))
+def transform_excels(input_dir="converted", output_dir="transformed", size_columns=True,
+                     width_sample_rows=WIDTH_SAMPLE_ROWS, state_db=None, file_format=None,
+                     row_filters=None):
+    """
+    Clean every converted register in input_dir into one sheet per file.
 
-                with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                    combined_df.to_excel(writer, index=False)
-                    worksheet = writer.sheets['Sheet1']
+    Parameters:
+    input_dir (str): Directory with the converted files
+    output_dir (str): Target directory for the transformed files
+    size_columns (bool): Set column widths for reading in Excel; turn off
+        for outputs only consumed by the next stage
+    width_sample_rows (int): Rows sampled for the widths (None: all)
+    state_db (str): SQLite manifest (see manifest.py); if given, files whose
+        content is unchanged since they were last transformed are skipped
+    file_format (str): Format of the converted and transformed files, one of
+        table_io.FORMAT_SUFFIXES (default table_io.INTERMEDIATE_FORMAT)
+    row_filters (dict): Patterns of the rows to drop (see row_filter_mask),
+        defaults to ROW_FILTER_PATTERNS
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    excel_files = sorted(Path(input_dir).glob(f"*{stage_suffix(file_format)}"))
+    # Column widths only matter to Excel
+    size_columns = size_columns and stage_suffix(file_format) == ".xlsx"
+    manifest = open_manifest(state_db) if state_db else None
+    if manifest:
+        hashes = changed_files(manifest, "transform", input_dir, [f.name for f in excel_files])
+        excel_files = [f for f in excel_files if f.name in hashes]
+
+    for excel_file in excel_files:
+        output_path = Path(output_dir) / f"transformed_{excel_file.name}"
 
-                    # Column width adjustment (now with proper import)
-                    for col_num, column_name in enumerate(combined_df.columns, 1):
-                        max_length = max(
-                            combined_df[column_name].astype(str).map(len).max(),
-                            len(str(column_name))
-                        ) + 2
-                        worksheet.column_dimensions[get_column_letter(col_num)].width = max_length
+        try:
+            with track("transform", excel_file.name) as metrics:
+                metrics["bytes_in"] = file_size(excel_file)
+                all_sheets = read_table_sheets(excel_file, file_format)
+                metrics["rows_in"] = sum(len(df) for df in all_sheets.values())
+                widths = {} if size_columns else None
+                combined_df = clean_sheets(all_sheets, widths, width_sample_rows, row_filters)
+                metrics["rows_out"] = 0 if combined_df is None else len(combined_df)
 
-                print(f"Successfully processed: {excel_file.name}")
+                if combined_df is not None:
+                    save_transformed(combined_df, output_path,
+                                     widths_for(combined_df, widths) if size_columns else None, file_format)
+                    metrics["bytes_out"] = file_size(output_path)
+                    print(f"Successfully processed: {excel_file.name}")
+            if manifest:
+                record(manifest, "transform", excel_file.name, hashes[excel_file.name],
+                       output_path if combined_df is not None else None)
 
         except Exception as e:
             print(f"Failed processing {excel_file.name}: {str(e)}")
-transform_excels()
+
+    if manifest:
+        manifest.close()
+
+
+if __name__ == "__main__":
+    transform_excels()
@@ -1,52 +1,103 @@
 import os
 import re
+from functools import lru_cache
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from openpyxl.utils import get_column_letter
+from table_io import (WIDTH_SAMPLE_ROWS, read_table_sheets, stage_suffix, update_column_widths,
+                      widths_for, write_table)
 import logging
 
-def extract_metadata(info_lines):
+METADATA_FIELDS = ['district', 'parish', 'constituency', 'polling_station', 'sub_county']
+
+# Example: District : 76 OYAM Parish : 01 ABANYA
+DISTRICT_PARISH_PATTERN = re.compile(r'District\s*:\s*([^P]+)Parish\s*:\s*(.+)')
+# Example: Constituency : 004 OYAM COUNTY NORTH Polling Station : 01 BAR OBIA
+CONSTITUENCY_STATION_PATTERN = re.compile(r'Constituency\s*:\s*([^P]+)Polling Station\s*:\s*(.+)')
+# Example: Sub-County : 01 ACHABA
+SUB_COUNTY_PATTERN = re.compile(r'Sub-County\s*:\s*(.+)')
+
+# Distinct header blocks remembered by parse_header_block; a register repeats
+# the same block on every page of a polling station
+HEADER_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=HEADER_CACHE_SIZE)
+def parse_header_block(info_lines):
     """
-    Extract district, parish, constituency, polling station, sub county info from list of header strings.
+    Metadata values of a header block (tuple of lines), in METADATA_FIELDS
+    order. Cached, so a block repeated across pages is only parsed once.
     """
-    metadata = dict.fromkeys(['district', 'parish', 'constituency', 'polling_station', 'sub_county'], None)
+    metadata = dict.fromkeys(METADATA_FIELDS, None)
 
     for line in info_lines:
         if 'District' in line and 'Parish' in line:
-            # Example: District : 76 OYAM Parish : 01 ABANYA
-            match = re.search(r'District\s*:\s*([^P]+)Parish\s*:\s*(.+)', line)
+            match = DISTRICT_PARISH_PATTERN.search(line)
             if match:
                 metadata['district'] = match.group(1).strip()
                 metadata['parish'] = match.group(2).strip()
         elif 'Constituency' in line and 'Polling Station' in line:
-            # Example: Constituency : 004 OYAM COUNTY NORTH Polling Station : 01 BAR OBIA
-            match = re.search(r'Constituency\s*:\s*([^P]+)Polling Station\s*:\s*(.+)', line)
+            match = CONSTITUENCY_STATION_PATTERN.search(line)
             if match:
                 metadata['constituency'] = match.group(1).strip()
                 metadata['polling_station'] = match.group(2).strip()
         elif 'Sub-County' in line:
-            # Example: Sub-County : 01 ACHABA
-            match = re.search(r'Sub-County\s*:\s*(.+)', line)
+            match = SUB_COUNTY_PATTERN.search(line)
             if match:
                 metadata['sub_county'] = match.group(1).strip()
-    return metadata
+    return tuple(metadata.values())
+
+def extract_metadata(info_lines):
+    """
+    Extract district, parish, constituency, polling station, sub county info from list of header strings.
+    """
+    return dict(zip(METADATA_FIELDS, parse_header_block(tuple(info_lines))))
+
+def metadata_columns(sheet_metadata, sheet_rows):
+    """
+    One categorical column per metadata field for the stacked sheets, built
+    from each sheet's parse_header_block values and row count without
+    materialising a string per row.
+    """
+    columns = {}
+    for i, field in enumerate(METADATA_FIELDS):
+        values = pd.Series([m[i] for m in sheet_metadata], dtype=object)
+        codes, categories = pd.factorize(values)
+        columns[field] = pd.Categorical.from_codes(np.repeat(codes, sheet_rows), categories=categories)
+    return columns
 
 def transform_excels_with_metadata(
     input_dir="converted",
     output_dir="transformed",
     skip_rows=3,
-    serial_number_column="Serial No"
+    serial_number_column="Serial No",
+    size_columns=True,
+    width_sample_rows=WIDTH_SAMPLE_ROWS,
+    file_format=None
 ):
+    """
+    Clean every converted register in input_dir into one sheet per file,
+    adding the district/parish/constituency/polling station/sub county
+    header values as categorical columns.
+
+    size_columns (bool): Set column widths for reading in Excel; turn off
+        for outputs only consumed by the next stage
+    width_sample_rows (int): Rows per sheet sampled for the widths (None: all)
+    file_format (str): Format of the converted and transformed files, one of
+        table_io.FORMAT_SUFFIXES (default table_io.INTERMEDIATE_FORMAT)
+    """
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    size_columns = size_columns and stage_suffix(file_format) == ".xlsx"
 
-    for excel_file in Path(input_dir).glob("*.xlsx"):
+    for excel_file in Path(input_dir).glob(f"*{stage_suffix(file_format)}"):
         outname = Path(output_dir) / f"transformed_{excel_file.name}"
-        processed_data = []
+        processed_data, sheet_metadata = [], []
+        widths = {}
         logging.info(f"Processing file: {excel_file.name}")
 
         try:
-            all_sheets = pd.read_excel(excel_file, engine="openpyxl", sheet_name=None)
+            all_sheets = read_table_sheets(excel_file, file_format)
         except Exception as e:
             logging.error(f"Could not read {excel_file.name}: {e}")
             continue
@@ -54,8 +105,8 @@ def transform_excels_with_metadata(
         for sheet, df in all_sheets.items():
             try:
 
-                info_lines = df.iloc[3:5, 0].dropna().astype(str).tolist()
-                metadata = extract_metadata(info_lines)
+                info_lines = tuple(df.iloc[3:5, 0].dropna().astype(str))
+                metadata = parse_header_block(info_lines)
 
                 # Skip first 3 rows (per latest requirement)
                 df_clean = df.iloc[skip_rows:].reset_index(drop=True)
@@ -72,30 +123,30 @@ def transform_excels_with_metadata(
                     lambda col: col.str.strip() if col.dtype == "object" else col
                 )
 
-                # Add metadata columns
-                for key, value in metadata.items():
-                    df_clean[key] = value
-
                 processed_data.append(df_clean)
+                sheet_metadata.append(metadata)
+                if size_columns:
+                    update_column_widths(widths, df_clean, width_sample_rows)
             except Exception as e:
                 logging.error(f"Error processing sheet {sheet}: {e}")
 
         # Concatenate all sheets data, add serial number, and save
         if processed_data:
             combined = pd.concat(processed_data, ignore_index=True)
+            # Metadata columns go after the sheet columns
+            for field, column in metadata_columns(sheet_metadata, [len(d) for d in processed_data]).items():
+                combined[field] = column
+            if size_columns:
+                update_column_widths(widths, combined[METADATA_FIELDS], width_sample_rows)
             combined.insert(0, serial_number_column, range(1, len(combined) + 1))
 
-            with pd.ExcelWriter(outname, engine="openpyxl") as writer:
-                combined.to_excel(writer, index=False)
-                worksheet = writer.sheets["Sheet1"]
-                for idx, column in enumerate(combined.columns, 1):
-                    max_width = max(combined[column].astype(str).map(len).max(), len(str(column))) + 2
-                    worksheet.column_dimensions[get_column_letter(idx)].width = max_width
+            widths[serial_number_column] = max(len(str(len(combined))), len(serial_number_column)) + 2
+            write_table(combined, outname, file_format,
+                        column_widths=widths_for(combined, widths) if size_columns else None)
 
             logging.info(f"Exported cleaned data to: {outname}")
 
 
-extract_metadata(info_lines)
 # transform_excels_with_metadata(
 #         input_dir="converted",    # Set to your source directory
 #         output_dir="transformed", # Set to your output directory
@@ -0,0 +1,196 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Poll interval (seconds) used to check for timed out or crashed workers.
+POLL_INTERVAL = 0.5
+
+
+def _worker_main(conn, func: Callable, initializer: Optional[Callable], initargs: tuple) -> None:
+    """
+    Worker process loop: receive batches of (key, args) jobs and report
+    a 'start' (with the job's time.time() start time) and a 'done' (with
+    its elapsed seconds) message for every job back to the parent.
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            batch = conn.recv()
+        except EOFError:
+            return
+        if batch is None:
+            return
+        for key, args in batch:
+            # The start time travels with the message, so the parent's timeout
+            # doesn't depend on when it gets round to reading it
+            conn.send(("start", key, None, None, time.time()))
+            start = time.perf_counter()
+            try:
+                value, error = func(*args), None
+            except Exception as e:
+                value, error = None, f"{type(e).__name__}: {e}"
+            conn.send(("done", key, value, error, time.perf_counter() - start))
+
+
+def _result(key, status: str, elapsed: float, error: Optional[str] = None, value: Any = None) -> Dict[str, Any]:
+    return {"key": key, "status": status, "elapsed": elapsed, "error": error, "value": value}
+
+
+def run_sequential(func: Callable, jobs: Iterable[Tuple[Any, tuple]]) -> Iterator[Dict[str, Any]]:
+    """
+    In-process counterpart of `imap_jobs`, yielding the same result records.
+    """
+    for key, args in jobs:
+        start = time.perf_counter()
+        try:
+            value = func(*args)
+            yield _result(key, "ok", time.perf_counter() - start, value=value)
+        except Exception as e:
+            yield _result(key, "failed", time.perf_counter() - start, f"{type(e).__name__}: {e}")
+
+
+def imap_jobs(
+    func: Callable,
+    jobs: Iterable[Tuple[Any, tuple]],
+    workers: int = None,
+    timeout: Optional[float] = None,
+    batch_size: int = 1,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run `func(*args)` for every (key, args) job on a pool of long-lived worker
+    processes and yield one result record per job as soon as it finishes.
+
+    Each record is a dict with 'key', 'status' ('ok', 'failed', 'timeout' or
+    'crashed'), 'elapsed' seconds, 'error' and the returned 'value'.
+    A job running longer than `timeout` seconds, or whose worker dies, is
+    reported and its worker replaced; the rest of the batch carries on.
+    Jobs are only handed out while the caller keeps consuming results.
+
+    Parameters:
+    func (callable): Module-level function executed in the workers
+    jobs (iterable): (key, args) pairs
+    workers (int): Number of worker processes (defaults to CPU count)
+    timeout (float): Per-job timeout in seconds (None disables it)
+    batch_size (int): Number of jobs sent to a worker at a time
+    initializer (callable): Called once in every worker on startup
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    batch_size = max(1, batch_size)
+    pending = deque(jobs)
+    ctx = multiprocessing.get_context("spawn")
+    pool: Dict[int, Dict[str, Any]] = {}
+
+    def spawn():
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_worker_main,
+                           args=(child_conn, func, initializer, initargs), daemon=True)
+        proc.start()
+        child_conn.close()
+        pool[proc.pid] = {"proc": proc, "conn": parent_conn, "assigned": [], "current": None, "started": None}
+
+    def retire(pid, requeue_from):
+        # Put the unstarted jobs of a dead worker back in front of the queue.
+        w = pool.pop(pid)
+        pending.extendleft(reversed(w["assigned"][requeue_from:]))
+        w["conn"].close()
+        if w["proc"].is_alive():
+            w["proc"].terminate()
+        w["proc"].join(1)
+        if pending:
+            spawn()
+
+    def receive(w, message):
+        # Apply one worker message; returns the result record of a finished job
+        kind, key, value, error, seconds = message
+        if kind == "start":
+            w["current"], w["started"] = key, seconds  # the worker's start time
+            return None
+        w["assigned"] = [job for job in w["assigned"] if job[0] != key]
+        w["current"] = w["started"] = None
+        return _result(key, "failed" if error else "ok", seconds, error, value)
+
+    def drain(w):
+        # Results the worker already sent; a job that finished while the
+        # caller was busy with earlier results must not count as timed out
+        results = []
+        try:
+            while w["conn"].poll():
+                result = receive(w, w["conn"].recv())
+                if result:
+                    results.append(result)
+        except (EOFError, OSError):
+            pass
+        return results
+
+    for _ in range(min(workers, len(pending))):
+        spawn()
+
+    try:
+        while pool and (pending or any(w["assigned"] for w in pool.values())):
+            for w in pool.values():
+                if not w["assigned"] and pending:
+                    # Near the end of the queue, leave jobs for the other workers
+                    size = min(batch_size, -(-len(pending) // len(pool)))
+                    batch = [pending.popleft() for _ in range(size)]
+                    w["assigned"] = batch
+                    w["conn"].send(batch)
+
+            busy = {w["conn"]: pid for pid, w in pool.items() if w["assigned"]}
+            for conn in wait(list(busy), timeout=POLL_INTERVAL):
+                pid = busy[conn]
+                w = pool[pid]
+                try:
+                    result = receive(w, conn.recv())
+                except (EOFError, OSError):
+                    continue  # handled by the liveness check below
+                if result:
+                    yield result
+
+            for pid, w in list(pool.items()):
+                yield from drain(w)
+                if not w["assigned"]:
+                    continue
+                now = time.time()
+                if w["current"] is not None and timeout and now - w["started"] > timeout:
+                    key, elapsed = w["current"], now - w["started"]
+                    retire(pid, 1)
+                    yield _result(key, "timeout", elapsed, f"Timed out after {timeout}s")
+                elif not w["proc"].is_alive():
+                    key = w["assigned"][0][0]
+                    elapsed = now - w["started"] if w["started"] else 0.0
+                    code = w["proc"].exitcode
+                    retire(pid, 1)
+                    yield _result(key, "crashed", elapsed, f"Worker exited with code {code}")
+    finally:
+        for w in pool.values():
+            try:
+                w["conn"].send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for w in pool.values():
+            w["proc"].join(1)
+            if w["proc"].is_alive():
+                w["proc"].terminate()
+            w["conn"].close()
+
+
+def summarize(results: List[Dict[str, Any]]) -> str:
+    """
+    Format per-job results as a plain text summary table.
+    """
+    lines = [f"{'STATUS':<8} {'SECONDS':>9}  FILE"]
+    for r in results:
+        line = f"{r['status']:<8} {r['elapsed']:>9.2f}  {r['key']}"
+        if r["error"]:
+            line += f"  ({r['error']})"
+        lines.append(line)
+    ok = sum(r["status"] == "ok" for r in results)
+    total = sum(r["elapsed"] for r in results)
+    lines.append(f"{ok}/{len(results)} succeeded, {len(results) - ok} failed, {total:.2f}s total work time")
+    return "\n".join(lines)